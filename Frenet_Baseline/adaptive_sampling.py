@@ -0,0 +1,249 @@
+"""
+Coarse-to-fine adaptive sampling of the Frenet lattice
+
+The dense lattice of calc_frenet_paths grows with the product of its
+lateral offset, horizon time and target speed axes. adaptive_planning
+evaluates only a subset of it: first a coarse lattice taking every
+2**depth-th sample of each axis, then `depth` refinement levels, each
+evaluating the not yet seen neighbours at half the previous spacing
+around the `keep` cheapest feasible candidates found so far. A candidate
+budget caps the total number of candidates converted and checked.
+
+The result is always a candidate of the dense lattice, so it can be
+compared directly with the exhaustive search:
+
+>>> lattice = fot.FrenetLattice.from_grid(7.0, 0.25, 3.0, 6.0, 0.2,
+...                                       30.0 / 3.6, 1.0 / 3.6, 5)
+>>> path, stats = adaptive_planning(csp, s0, c_speed, c_accel, c_d,
+...                                 c_d_d, c_d_dd, ob, lattice=lattice)
+>>> compare_exhaustive(csp, s0, c_speed, c_accel, c_d, c_d_d, c_d_dd,
+...                    ob, lattice=lattice)
+
+usage:
+    python adaptive_sampling.py --d-road-w 0.25 --n-s-sample 5
+"""
+
+import argparse
+import pathlib
+import sys
+import time
+
+import numpy as np
+
+sys.path.append(str(pathlib.Path(__file__).parent))
+
+import frenet_optimal_trajectory as fot
+
+ADAPTIVE_DEPTH = 2  # refinement levels after the coarse lattice
+ADAPTIVE_KEEP = 4  # candidates refined around per level
+ADAPTIVE_BUDGET = 400  # maximum number of candidates evaluated
+
+
+def coarse_samples(shape, step):
+    """
+    flat lattice indices of every `step`-th sample along each axis, the
+    last sample of every axis included
+    """
+    axes = [np.unique(np.r_[np.arange(0, n, step), n - 1]) for n in shape]
+    grid = np.meshgrid(*axes, indexing="ij")
+    return np.ravel_multi_index([g.ravel() for g in grid], shape)
+
+
+def refine_samples(seeds, shape, step):
+    """
+    flat lattice indices of the {-step, 0, step} neighbourhood of every
+    seed inside the lattice, in seed order without repeats
+    """
+    n_axis = len(shape)
+    offset = np.stack(np.meshgrid(*[(-step, 0, step)] * n_axis,
+                                  indexing="ij"), axis=-1).reshape(-1, n_axis)
+    index = np.stack(np.unravel_index(seeds, shape), axis=-1)
+    index = (index[:, None, :] + offset[None, :, :]).reshape(-1, n_axis)
+    index = index[np.all((index >= 0) & (index < shape), axis=1)]
+    flat = np.ravel_multi_index(index.T, shape)
+    _, first = np.unique(flat, return_index=True)
+    return flat[np.sort(first)]
+
+
+def ranked(ids, cost):
+    """
+    `ids` by increasing cost, the later lattice candidate first on a tie
+    as in find_best_path
+    """
+    return ids[np.lexsort((-ids, cost[ids]))]
+
+
+def adaptive_planning(csp, s0, c_speed, c_accel, c_d, c_d_d, c_d_dd, ob,
+                      lattice=None, depth=ADAPTIVE_DEPTH, keep=ADAPTIVE_KEEP,
+                      budget=ADAPTIVE_BUDGET, config=None):
+    """
+    plan on a coarse-to-fine subset of `lattice`
+    lattice: dense FrenetLattice.from_grid, the grid of the config if None
+    depth: refinement levels, the coarse lattice takes every 2**depth-th
+        sample of each axis
+    keep: number of cheapest feasible candidates refined around per level,
+        the cheapest infeasible ones while nothing is feasible
+    budget: maximum number of candidates evaluated, None for no limit
+    config: PlannerConfig, the module parameters if None
+    return: the best FrenetPath found or None, and a dict of stats
+    """
+    if config is None:
+        config = fot.PlannerConfig.from_globals()
+    if lattice is None:
+        lattice = config.lattice()
+    if not isinstance(ob, fot.ObstacleGrid):
+        ob = fot.ObstacleGrid(ob, config.robot_radius)
+    shape = tuple(len(axis) for axis in lattice.axes)
+    budget = len(lattice) if budget is None else budget
+
+    cost = np.full(len(lattice), np.nan)
+    ok = np.zeros(len(lattice), dtype=bool)
+    seen = np.zeros(len(lattice), dtype=bool)
+    evaluated = []  # (lattice indices, candidates) per level
+    n_level = []
+
+    ids = coarse_samples(shape, 2 ** depth)
+    for level in range(depth + 1):
+        if level > 0:
+            feasible = np.flatnonzero(ok)
+            pool = feasible if len(feasible) > 0 else np.flatnonzero(seen)
+            seeds = ranked(pool, cost)[:keep]
+            ids = refine_samples(seeds, shape, 2 ** (depth - level))
+            ids = ids[~seen[ids]]
+        ids = ids[:max(budget - int(np.sum(seen)), 0)]
+        if len(ids) == 0:
+            break
+
+        sub = fot.FrenetLattice(lattice.D[ids], lattice.T[ids],
+                                lattice.V[ids], lattice.dt)
+        paths = fot.calc_frenet_paths(c_speed, c_accel, c_d, c_d_d, c_d_dd,
+                                      s0, lattice=sub, config=config)
+        paths = fot.calc_global_paths(paths, csp)
+        ok[ids] = fot.check_paths(paths, ob, config)
+        cost[ids] = paths.cf
+        seen[ids] = True
+        evaluated.append((ids, paths))
+        n_level.append(len(ids))
+
+    stats = {"n_dense": len(lattice), "n_evaluated": int(np.sum(seen)),
+             "n_level": n_level, "cost": None, "index": None}
+    feasible = np.flatnonzero(ok)
+    if len(feasible) == 0:
+        return None, stats
+
+    best = ranked(feasible, cost)[0]
+    stats["cost"] = float(cost[best])
+    stats["index"] = int(best)
+    for ids, paths in evaluated:
+        row = np.flatnonzero(ids == best)
+        if len(row) > 0:
+            return paths.to_frenet_path(row[0]), stats
+
+
+def compare_exhaustive(csp, s0, c_speed, c_accel, c_d, c_d_d, c_d_dd, ob,
+                       lattice=None, config=None, **kwargs):
+    """
+    run adaptive_planning and the exhaustive search over the same dense
+    lattice, kwargs are passed on to adaptive_planning
+    return: the adaptive stats extended with the exhaustive optimum, the
+        cost gap, whether both chose the same candidate and both run times
+    """
+    if config is None:
+        config = fot.PlannerConfig.from_globals()
+    if lattice is None:
+        lattice = config.lattice()
+    if not isinstance(ob, fot.ObstacleGrid):
+        ob = fot.ObstacleGrid(ob, config.robot_radius)
+
+    start = time.perf_counter()
+    _, stats = adaptive_planning(csp, s0, c_speed, c_accel, c_d, c_d_d,
+                                 c_d_dd, ob, lattice=lattice, config=config,
+                                 **kwargs)
+    stats["time"] = time.perf_counter() - start
+
+    start = time.perf_counter()
+    paths = fot.calc_frenet_paths(c_speed, c_accel, c_d, c_d_d, c_d_dd, s0,
+                                  lattice=lattice, config=config)
+    paths = fot.calc_global_paths(paths, csp)
+    ok = fot.check_paths(paths, ob, config)
+    stats["exhaustive_time"] = time.perf_counter() - start
+
+    stats["exhaustive_cost"] = None
+    stats["exhaustive_index"] = None
+    stats["gap"] = None
+    if np.any(ok):
+        best = ranked(np.flatnonzero(ok), paths.cf)[0]
+        stats["exhaustive_cost"] = float(paths.cf[best])
+        stats["exhaustive_index"] = int(best)
+        if stats["cost"] is not None:
+            stats["gap"] = stats["cost"] - stats["exhaustive_cost"]
+    stats["same_path"] = stats["index"] == stats["exhaustive_index"]
+    return stats
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[1])
+    parser.add_argument("--d-road-w", type=float, default=0.25,
+                        help="lateral sampling of the dense lattice [m]")
+    parser.add_argument("--dt-t", type=float, default=0.2,
+                        help="horizon time sampling of the dense lattice [s]")
+    parser.add_argument("--n-s-sample", type=int, default=5,
+                        help="target speed samples on each side")
+    parser.add_argument("--depth", type=int, default=ADAPTIVE_DEPTH)
+    parser.add_argument("--keep", type=int, default=ADAPTIVE_KEEP)
+    parser.add_argument("--budget", type=int, default=ADAPTIVE_BUDGET)
+    parser.add_argument("--sim-loop", type=int, default=50)
+    args = parser.parse_args()
+
+    wx = [0.0, 10.0, 20.5, 35.0, 70.5]
+    wy = [0.0, -6.0, 5.0, 6.5, 0.0]
+    ob = np.array([[20.0, 10.0], [30.0, 6.0], [30.0, 8.0], [35.0, 8.0],
+                   [50.0, 3.0]])
+    _, _, _, _, csp = fot.generate_target_course(wx, wy)
+    lattice = fot.FrenetLattice.from_grid(
+        fot.MAX_ROAD_WIDTH, args.d_road_w, 3.0, 6.0, args.dt_t,
+        fot.TARGET_SPEED, fot.D_T_S / args.n_s_sample, args.n_s_sample)
+
+    # replay a closed-loop run of the exhaustive planner, comparing both
+    # searches from every state it visits
+    state = (0.0, 10.0 / 3.6, 0.0, 2.0, 0.0, 0.0)
+    rows = []
+    for _ in range(args.sim_loop):
+        stats = compare_exhaustive(csp, *state, ob, lattice=lattice,
+                                   depth=args.depth, keep=args.keep,
+                                   budget=args.budget)
+        if stats["exhaustive_index"] is None:
+            break
+        rows.append(stats)
+        paths = fot.calc_frenet_paths(*state[1:], state[0], lattice=lattice)
+        best = stats["exhaustive_index"]
+        state = tuple(float(getattr(paths, name)[best, 1]) for name in
+                      ("s", "s_d", "s_dd", "d", "d_d", "d_dd"))
+
+    print("dense lattice %d candidates, %d cycles" % (len(lattice),
+                                                      len(rows)))
+    if len(rows) == 0:
+        print("  no cycle with an exhaustive path")
+        return
+    gap = np.array([np.inf if row["gap"] is None else row["gap"]
+                    for row in rows])
+    relative = gap / np.array([row["exhaustive_cost"] for row in rows])
+    finite = relative[np.isfinite(relative)]
+    print("  evaluated     mean %.0f max %d (%.1f%% of dense)" % (
+        np.mean([row["n_evaluated"] for row in rows]),
+        max(row["n_evaluated"] for row in rows),
+        100.0 * np.mean([row["n_evaluated"] for row in rows]) /
+        len(lattice)))
+    print("  same path     %d of %d" % (sum(row["same_path"] for row in rows),
+                                        len(rows)))
+    print("  cost gap      mean %.2f%% max %.2f%%, %d without a path" % (
+        100.0 * np.mean(finite) if len(finite) > 0 else np.nan,
+        100.0 * np.max(finite) if len(finite) > 0 else np.nan,
+        np.sum(~np.isfinite(relative))))
+    print("  time          adaptive %.1f ms exhaustive %.1f ms" % (
+        1e3 * np.mean([row["time"] for row in rows]),
+        1e3 * np.mean([row["exhaustive_time"] for row in rows])))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,182 @@
+"""
+Batch scenario runner for the Frenet optimal trajectory baseline
+
+Runs many headless closed-loop simulations (see
+frenet_optimal_trajectory.run_simulation) across a process pool and
+collects one result row per scenario.
+
+A scenario is a dict:
+    name: scenario name
+    wx, wy: way points of the course [m]
+    ob: obstacle points, list of [x, y] [m]
+    state: optional initial state, any of c_speed, c_accel, c_d, c_d_d,
+        c_d_dd, s0 (see run_simulation for the defaults)
+    params: optional planner parameters overriding the module globals of
+        frenet_optimal_trajectory in the scenario's PlannerConfig, e.g.
+        {"MAX_SPEED": 10.0, "D_ROAD_W": 0.5}
+    sim_loop: optional maximum number of cycles
+
+usage:
+    python batch_runner.py scenarios.json -o results.csv -j 8
+    python batch_runner.py --random 1000 -o results.jsonl
+"""
+
+import argparse
+import csv
+import dataclasses
+import json
+import multiprocessing
+import pathlib
+import sys
+import time
+import traceback
+
+import numpy as np
+
+sys.path.append(str(pathlib.Path(__file__).parent))
+
+import frenet_optimal_trajectory as fot
+
+RESULT_FIELDS = ["name", "status", "goal", "cycles", "wall_time",
+                 "latency_mean", "latency_median", "latency_p99",
+                 "latency_max", "cost_mean", "cost_total", "s", "d", "speed",
+                 "error"]
+
+
+def run_scenario(scenario):
+    """
+    run one scenario in this process and return its result row
+    """
+    params = scenario.get("params", {})
+    fields = {field.name for field in dataclasses.fields(fot.PlannerConfig)}
+    row = {"name": scenario.get("name", ""), "error": ""}
+    start = time.perf_counter()
+    try:
+        for key in params:
+            if key.lower() not in fields:
+                raise ValueError("unknown planner parameter: " + key)
+        config = dataclasses.replace(
+            fot.PlannerConfig.from_globals(),
+            **{key.lower(): value for key, value in params.items()})
+
+        result = fot.run_simulation(
+            scenario["wx"], scenario["wy"], scenario.get("ob", []),
+            sim_loop=scenario.get("sim_loop", fot.SIM_LOOP), config=config,
+            **scenario.get("state", {}))
+    except Exception:
+        row.update(status="error", goal=False, cycles=0,
+                   error=traceback.format_exc(limit=2).strip(), latency=[])
+        return row
+    row["wall_time"] = time.perf_counter() - start
+
+    latency = np.array(result["latency"])
+    cost = np.array(result["cost"])
+    row.update(status=result["status"], goal=result["status"] == "goal",
+               cycles=result["cycles"], latency=result["latency"],
+               s=result["s"], d=result["d"], speed=result["speed"])
+    if len(latency) > 0:
+        row.update(latency_mean=latency.mean(),
+                   latency_median=np.median(latency),
+                   latency_p99=np.percentile(latency, 99),
+                   latency_max=latency.max())
+    if len(cost) > 0:
+        row.update(cost_mean=cost.mean(), cost_total=cost.sum())
+
+    return row
+
+
+def run_batch(scenarios, processes=None, chunksize=1):
+    """
+    run every scenario across a process pool
+    processes: number of worker processes, all cores if None, and the
+        scenarios run in this process if 1
+    return: result rows in the order of `scenarios`
+    """
+    if processes == 1:
+        return [run_scenario(s) for s in scenarios]
+
+    with multiprocessing.Pool(processes) as pool:
+        return list(pool.imap(run_scenario, scenarios, chunksize=chunksize))
+
+
+def make_random_scenarios(n, seed=0):
+    """
+    random courses with obstacles scattered around them, for smoke tests
+    and load
+    """
+    rng = np.random.default_rng(seed)
+    scenarios = []
+    for i in range(n):
+        n_wp = rng.integers(4, 8)
+        wx = np.cumsum(rng.uniform(8.0, 15.0, n_wp)) - 8.0
+        wy = np.cumsum(rng.normal(0.0, 4.0, n_wp))
+        n_ob = rng.integers(0, 10)
+        ob_x = rng.uniform(wx[0] + 10.0, wx[-1], n_ob)
+        ob_y = np.interp(ob_x, wx, wy) + rng.uniform(-6.0, 6.0, n_ob)
+        scenarios.append({
+            "name": "random_%d" % i,
+            "wx": wx.tolist(), "wy": wy.tolist(),
+            "ob": np.column_stack([ob_x, ob_y]).tolist(),
+            "state": {"c_d": float(rng.uniform(-2.0, 2.0))},
+        })
+    return scenarios
+
+
+def load_scenarios(path):
+    """
+    load scenarios from a JSON list or a JSON lines file
+    """
+    text = pathlib.Path(path).read_text()
+    if text.lstrip().startswith("["):
+        return json.loads(text)
+    return [json.loads(line) for line in text.splitlines() if line.strip()]
+
+
+def write_results(rows, path):
+    """
+    write result rows as CSV (summary columns only) or, for any other
+    extension, as JSON lines including the per-cycle latency
+    """
+    path = pathlib.Path(path)
+    if path.suffix == ".csv":
+        with path.open("w", newline="") as f:
+            writer = csv.DictWriter(f, RESULT_FIELDS, extrasaction="ignore")
+            writer.writeheader()
+            writer.writerows(rows)
+    else:
+        with path.open("w") as f:
+            for row in rows:
+                f.write(json.dumps(row, default=float) + "\n")
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[1])
+    parser.add_argument("scenarios", nargs="?",
+                        help="JSON or JSON lines scenario file")
+    parser.add_argument("--random", type=int, default=0,
+                        help="run N random scenarios instead")
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("-o", "--output", default="results.csv")
+    parser.add_argument("-j", "--processes", type=int, default=None)
+    parser.add_argument("--chunksize", type=int, default=1)
+    args = parser.parse_args()
+
+    if args.random > 0:
+        scenarios = make_random_scenarios(args.random, args.seed)
+    elif args.scenarios:
+        scenarios = load_scenarios(args.scenarios)
+    else:
+        parser.error("give a scenario file or --random N")
+
+    start = time.perf_counter()
+    rows = run_batch(scenarios, args.processes, args.chunksize)
+    write_results(rows, args.output)
+
+    n_goal = sum(row["goal"] for row in rows)
+    n_error = sum(row["status"] == "error" for row in rows)
+    print("%d scenarios, %d reached the goal, %d errors, %.1f s -> %s" % (
+        len(rows), n_goal, n_error, time.perf_counter() - start, args.output))
+
+
+if __name__ == '__main__':
+    main()
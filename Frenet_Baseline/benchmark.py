@@ -0,0 +1,238 @@
+"""
+Benchmark suite for the Frenet optimal trajectory baseline
+
+Times the planner hot paths (calc_frenet_paths, calc_global_paths,
+check_paths, check_collision, CubicSpline2D construction and a full
+frenet_optimal_planning cycle) while sweeping lattice density
+(D_ROAD_W, DT, N_S_SAMPLE), obstacle count and way point count.
+Every case reports median and p99 latency and peak traced memory, and
+the whole run is written as JSON together with the commit it ran on,
+so results of two commits can be compared with --compare.
+
+usage:
+    python benchmark.py -o bench.json
+    python benchmark.py --quick -o new.json --compare bench.json
+"""
+
+import argparse
+import contextlib
+import datetime
+import gc
+import json
+import pathlib
+import platform
+import subprocess
+import sys
+import time
+import tracemalloc
+
+import numpy as np
+
+sys.path.append(str(pathlib.Path(__file__).parent))
+
+import cubic_spline_planner
+import frenet_optimal_trajectory as fot
+
+# default scenario, same as frenet_optimal_trajectory.main
+WX = [0.0, 10.0, 20.5, 35.0, 70.5]
+WY = [0.0, -6.0, 5.0, 6.5, 0.0]
+STATE = dict(c_speed=10.0 / 3.6, c_accel=0.0, c_d=2.0, c_d_d=0.0,
+             c_d_dd=0.0, s0=0.0)
+
+LATTICE_SWEEP = [
+    dict(D_ROAD_W=1.0, DT=0.2, N_S_SAMPLE=1),
+    dict(D_ROAD_W=0.5, DT=0.2, N_S_SAMPLE=1),
+    dict(D_ROAD_W=0.25, DT=0.2, N_S_SAMPLE=1),
+    dict(D_ROAD_W=1.0, DT=0.1, N_S_SAMPLE=1),
+    dict(D_ROAD_W=1.0, DT=0.2, N_S_SAMPLE=3),
+    dict(D_ROAD_W=0.25, DT=0.1, N_S_SAMPLE=3),
+]
+OBSTACLE_SWEEP = [0, 1, 10, 100, 1000, 5000]
+WAYPOINT_SWEEP = [5, 50, 500, 5000]
+
+
+@contextlib.contextmanager
+def planner_params(**params):
+    """
+    temporarily override module parameters of frenet_optimal_trajectory
+    """
+    saved = {key: getattr(fot, key) for key in params}
+    try:
+        for key, value in params.items():
+            setattr(fot, key, value)
+        yield
+    finally:
+        for key, value in saved.items():
+            setattr(fot, key, value)
+
+
+def measure(fn, repeat, warmup=2):
+    """
+    run `fn` warmup + repeat times
+    return: median and p99 wall time [s] and peak traced memory [byte]
+    """
+    for _ in range(warmup):
+        fn()
+
+    times = []
+    gc.collect()
+    for _ in range(repeat):
+        start = time.perf_counter()
+        fn()
+        times.append(time.perf_counter() - start)
+
+    # traced separately, tracemalloc slows the timed runs down
+    tracemalloc.start()
+    fn()
+    _, peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+
+    return {"median_s": float(np.median(times)),
+            "p99_s": float(np.percentile(times, 99)),
+            "peak_bytes": int(peak), "repeat": repeat}
+
+
+def make_obstacles(csp, n, seed=0):
+    """
+    n obstacle points scattered within +-10 m of the course
+    """
+    rng = np.random.default_rng(seed)
+    s = rng.uniform(0.0, csp.s[-1], n)
+    x, y = csp.calc_position_array(s)
+    yaw = csp.calc_yaw_array(s)
+    d = rng.uniform(-10.0, 10.0, n)
+    return np.column_stack([x - d * np.sin(yaw), y + d * np.cos(yaw)])
+
+
+def make_waypoints(n, seed=0):
+    """
+    n way points of a gently winding course, 1 m to 3 m apart
+    """
+    rng = np.random.default_rng(seed)
+    heading = np.cumsum(rng.normal(0.0, 0.1, n))
+    step = rng.uniform(1.0, 3.0, n)
+    return (np.cumsum(step * np.cos(heading)),
+            np.cumsum(step * np.sin(heading)))
+
+
+def bench_lattice(repeat):
+    _, _, _, _, csp = fot.generate_target_course(WX, WY)
+    ob = np.array([[30.0, 8.0]])
+    grid = fot.ObstacleGrid(ob, fot.ROBOT_RADIUS)
+    for params in LATTICE_SWEEP:
+        with planner_params(**params):
+            paths = fot.calc_frenet_paths(**STATE)
+            global_paths = fot.calc_global_paths(
+                fot.calc_frenet_paths(**STATE), csp)
+            cases = {
+                "calc_frenet_paths": lambda: fot.calc_frenet_paths(**STATE),
+                "calc_global_paths": lambda: fot.calc_global_paths(
+                    paths.take(np.arange(len(paths))), csp),
+                "check_paths": lambda: fot.check_paths(global_paths, grid),
+                "frenet_optimal_planning":
+                    lambda: fot.frenet_optimal_planning(csp, ob=ob, **STATE),
+                "frenet_optimal_planning_exhaustive":
+                    lambda: fot.frenet_optimal_planning(
+                        csp, ob=ob, best_first=False, **STATE),
+            }
+            for name, fn in cases.items():
+                yield name, dict(params, n_candidates=len(paths)), \
+                    measure(fn, repeat)
+
+
+def bench_obstacles(repeat):
+    _, _, _, _, csp = fot.generate_target_course(WX, WY)
+    paths = fot.calc_global_paths(fot.calc_frenet_paths(**STATE), csp)
+    for n in OBSTACLE_SWEEP:
+        ob = make_obstacles(csp, n)
+        cases = {
+            "check_collision": lambda: fot.check_collision(paths, ob),
+            "frenet_optimal_planning":
+                lambda: fot.frenet_optimal_planning(csp, ob=ob, **STATE),
+        }
+        for name, fn in cases.items():
+            yield name, {"n_obstacles": n}, measure(fn, repeat)
+
+
+def bench_waypoints(repeat):
+    for n in WAYPOINT_SWEEP:
+        wx, wy = make_waypoints(n)
+        csp = cubic_spline_planner.CubicSpline2D(wx, wy)
+        s = np.linspace(0.0, csp.s[-1], 10000)
+        cases = {
+            "CubicSpline2D":
+                lambda: cubic_spline_planner.CubicSpline2D(wx, wy),
+            "CubicSpline2D.calc_position_array":
+                lambda: csp.calc_position_array(s),
+        }
+        for name, fn in cases.items():
+            yield name, {"n_waypoints": n}, measure(fn, repeat)
+
+
+def git_commit():
+    try:
+        return subprocess.run(
+            ["git", "rev-parse", "HEAD"], capture_output=True, text=True,
+            cwd=pathlib.Path(__file__).parent, check=True).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def run(repeat):
+    results = []
+    for sweep in (bench_lattice, bench_obstacles, bench_waypoints):
+        for name, params, stats in sweep(repeat):
+            row = dict(bench=name, sweep=sweep.__name__[len("bench_"):],
+                       params=params, **stats)
+            print("%-36s %-60s median %9.3f ms  p99 %9.3f ms  peak %8.1f kB"
+                  % (name, json.dumps(params), stats["median_s"] * 1e3,
+                     stats["p99_s"] * 1e3, stats["peak_bytes"] / 1e3))
+            results.append(row)
+
+    return {
+        "commit": git_commit(),
+        "date": datetime.datetime.now(datetime.timezone.utc).isoformat(),
+        "python": platform.python_version(),
+        "numpy": np.__version__,
+        "machine": platform.platform(),
+        "results": results,
+    }
+
+
+def compare(new, old):
+    """
+    print the median latency ratio new / old of every case in both runs
+    """
+    def key(row):
+        return row["bench"], row["sweep"], json.dumps(row["params"],
+                                                      sort_keys=True)
+
+    old_rows = {key(row): row for row in old["results"]}
+    print("\nmedian latency vs %s" % old.get("commit"))
+    for row in new["results"]:
+        ref = old_rows.get(key(row))
+        if ref is None:
+            continue
+        print("%-36s %-60s %6.2fx" % (row["bench"], json.dumps(row["params"]),
+                                      row["median_s"] / ref["median_s"]))
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[1])
+    parser.add_argument("-o", "--output", default="bench.json")
+    parser.add_argument("-n", "--repeat", type=int, default=50)
+    parser.add_argument("--quick", action="store_true",
+                        help="5 repeats per case")
+    parser.add_argument("--compare", help="earlier result file")
+    args = parser.parse_args()
+
+    report = run(5 if args.quick else args.repeat)
+    pathlib.Path(args.output).write_text(json.dumps(report, indent=1))
+    print("-> " + args.output)
+
+    if args.compare:
+        compare(report, json.loads(pathlib.Path(args.compare).read_text()))
+
+
+if __name__ == '__main__':
+    main()
@@ -42,26 +42,25 @@ class CubicSpline1D:
         if np.any(h < 0):
             raise ValueError("x coordinates must be sorted in ascending order")
 
-        self.a, self.b, self.c, self.d = [], [], [], []
         self.x = x
         self.y = y
         self.nx = len(x)  # dimension of x
 
         # calc coefficient a
-        self.a = [iy for iy in y]
+        self.a = np.array(y, dtype=float)
 
-        # calc coefficient c
-        A = self.__calc_A(h)
+        # calc coefficient c, A is tridiagonal so it is kept as three bands
+        lower, diag, upper = self.__calc_A(h)
         B = self.__calc_B(h, self.a)
-        self.c = np.linalg.solve(A, B)
+        self.c = self.__solve_tridiagonal(lower, diag, upper, B)
 
         # calc spline coefficient b and d
-        for i in range(self.nx - 1):
-            d = (self.c[i + 1] - self.c[i]) / (3.0 * h[i])
-            b = 1.0 / h[i] * (self.a[i + 1] - self.a[i]) \
-                - h[i] / 3.0 * (2.0 * self.c[i] + self.c[i + 1])
-            self.d.append(d)
-            self.b.append(b)
+        self.d = np.diff(self.c) / (3.0 * h)
+        self.b = np.diff(self.a) / h - \
+            h / 3.0 * (2.0 * self.c[:-1] + self.c[1:])
+
+        # sorted x as an array for the vectorized *_array evaluation methods
+        self.__x = np.asarray(x, dtype=float)
 
     def calc_position(self, x):
         """
@@ -124,39 +123,150 @@ class CubicSpline1D:
         ddy = 2.0 * self.c[i] + 6.0 * self.d[i] * dx
         return ddy
 
+    def calc_position_array(self, x):
+        """
+        Calc `y` positions for an array of `x`.
+        `x` outside the data point's `x` range gives NaN.
+        Returns
+        -------
+        y : ndarray
+            y positions for given x, same shape as x.
+        """
+        i, dx, inside = self.__search_index_array(x)
+        position = self.a[i] + self.b[i] * dx + \
+            self.c[i] * dx ** 2.0 + self.d[i] * dx ** 3.0
+
+        return np.where(inside, position, np.nan)
+
+    def calc_first_derivative_array(self, x):
+        """
+        Calc first derivatives for an array of `x`.
+        `x` outside the data point's `x` range gives NaN.
+        Returns
+        -------
+        dy : ndarray
+            first derivatives for given x, same shape as x.
+        """
+        i, dx, inside = self.__search_index_array(x)
+        dy = self.b[i] + 2.0 * self.c[i] * dx + 3.0 * self.d[i] * dx ** 2.0
+
+        return np.where(inside, dy, np.nan)
+
+    def calc_second_derivative_array(self, x):
+        """
+        Calc second derivatives for an array of `x`.
+        `x` outside the data point's `x` range gives NaN.
+        Returns
+        -------
+        ddy : ndarray
+            second derivatives for given x, same shape as x.
+        """
+        i, dx, inside = self.__search_index_array(x)
+        ddy = 2.0 * self.c[i] + 6.0 * self.d[i] * dx
+
+        return np.where(inside, ddy, np.nan)
+
+    def calc_third_derivative_array(self, x):
+        """
+        Calc third derivatives for an array of `x`, constant per segment.
+        `x` outside the data point's `x` range gives NaN.
+        Returns
+        -------
+        dddy : ndarray
+            third derivatives for given x, same shape as x.
+        """
+        i, _, inside = self.__search_index_array(x)
+        dddy = 6.0 * self.d[i]
+
+        return np.where(inside, dddy, np.nan)
+
+    def calc_derivatives_array(self, x):
+        """
+        Calc positions and first to third derivatives for an array of `x`
+        with a single segment search.
+        `x` outside the data point's `x` range gives NaN.
+        Returns
+        -------
+        y, dy, ddy, dddy : ndarray
+            position and derivatives for given x, same shape as x.
+        """
+        i, dx, inside = self.__search_index_array(x)
+        a, b, c, d = self.a[i], self.b[i], self.c[i], self.d[i]
+        y = a + (b + (c + d * dx) * dx) * dx
+        dy = b + (2.0 * c + 3.0 * d * dx) * dx
+        ddy = 2.0 * c + 6.0 * d * dx
+        dddy = 6.0 * d
+
+        return [np.where(inside, v, np.nan) for v in (y, dy, ddy, dddy)]
+
     def __search_index(self, x):
         """
         search data segment index
         """
         return bisect.bisect(self.x, x) - 1
 
+    def __search_index_array(self, x):
+        """
+        search data segment indices for an array of x
+        return: segment index, offset into the segment and in-range mask
+        """
+        x = np.asarray(x, dtype=float)
+        inside = (x >= self.__x[0]) & (x <= self.__x[-1])
+        i = np.searchsorted(self.__x, x, side="right") - 1
+        i = np.clip(i, 0, self.nx - 2)
+        dx = np.where(inside, x - self.__x[i], 0.0)
+        return i, dx, inside
+
     def __calc_A(self, h):
         """
         calc matrix A for spline coefficient c
+        return: sub-diagonal, diagonal and super-diagonal of A
         """
-        A = np.zeros((self.nx, self.nx))
-        A[0, 0] = 1.0
-        for i in range(self.nx - 1):
-            if i != (self.nx - 2):
-                A[i + 1, i + 1] = 2.0 * (h[i] + h[i + 1])
-            A[i + 1, i] = h[i]
-            A[i, i + 1] = h[i]
+        lower = np.array(h, dtype=float)
+        upper = np.array(h, dtype=float)
+        diag = np.ones(self.nx)
+        diag[1:-1] = 2.0 * (h[:-1] + h[1:])
 
-        A[0, 1] = 0.0
-        A[self.nx - 1, self.nx - 2] = 0.0
-        A[self.nx - 1, self.nx - 1] = 1.0
-        return A
+        upper[0] = 0.0
+        lower[-1] = 0.0
+        return lower, diag, upper
 
     def __calc_B(self, h, a):
         """
         calc matrix B for spline coefficient c
         """
         B = np.zeros(self.nx)
-        for i in range(self.nx - 2):
-            B[i + 1] = 3.0 * (a[i + 2] - a[i + 1]) / h[i + 1]\
-                - 3.0 * (a[i + 1] - a[i]) / h[i]
+        slope = np.diff(a) / h
+        B[1:-1] = 3.0 * (slope[1:] - slope[:-1])
         return B
 
+    @staticmethod
+    def __solve_tridiagonal(lower, diag, upper, B):
+        """
+        solve A c = B for tridiagonal A with the Thomas algorithm, O(n)
+        lower[i] is A[i + 1, i] and upper[i] is A[i, i + 1]
+        """
+        lower, diag, upper, B = \
+            lower.tolist(), diag.tolist(), upper.tolist(), list(B)
+        n = len(diag)
+
+        # forward sweep
+        cp = [0.0] * (n - 1)
+        dp = [0.0] * n
+        cp[0] = upper[0] / diag[0]
+        dp[0] = B[0] / diag[0]
+        for i in range(1, n):
+            m = diag[i] - lower[i - 1] * cp[i - 1]
+            if i < n - 1:
+                cp[i] = upper[i] / m
+            dp[i] = (B[i] - lower[i - 1] * dp[i - 1]) / m
+
+        # back substitution
+        c = dp
+        for i in range(n - 2, -1, -1):
+            c[i] -= cp[i] * c[i + 1]
+        return np.array(c)
+
 
 class CubicSpline2D:
     """
@@ -280,20 +390,171 @@ class CubicSpline2D:
         yaw = math.atan2(dy, dx)
         return yaw
 
+    def calc_position_array(self, s):
+        """
+        calc positions for an array of s
+        Parameters
+        ----------
+        s : array_like
+            distances from the start point. `s` outside the data point's
+            range gives NaN.
+        Returns
+        -------
+        x : ndarray
+            x positions for given s.
+        y : ndarray
+            y positions for given s.
+        """
+        x = self.sx.calc_position_array(s)
+        y = self.sy.calc_position_array(s)
+
+        return x, y
+
+    def calc_curvature_array(self, s):
+        """
+        calc curvatures for an array of s
+        Parameters
+        ----------
+        s : array_like
+            distances from the start point. `s` outside the data point's
+            range gives NaN.
+        Returns
+        -------
+        k : ndarray
+            curvatures for given s.
+        """
+        dx = self.sx.calc_first_derivative_array(s)
+        ddx = self.sx.calc_second_derivative_array(s)
+        dy = self.sy.calc_first_derivative_array(s)
+        ddy = self.sy.calc_second_derivative_array(s)
+        k = (ddy * dx - ddx * dy) / ((dx ** 2 + dy ** 2)**(3 / 2))
+        return k
+
+    def calc_tangent_array(self, s):
+        """
+        calc tangent vectors (dx/ds, dy/ds) for an array of s, not
+        normalized since s is the chord length between the data points
+        Parameters
+        ----------
+        s : array_like
+            distances from the start point. `s` outside the data point's
+            range gives NaN.
+        Returns
+        -------
+        dx : ndarray
+            x derivatives for given s.
+        dy : ndarray
+            y derivatives for given s.
+        """
+        dx = self.sx.calc_first_derivative_array(s)
+        dy = self.sy.calc_first_derivative_array(s)
+
+        return dx, dy
+
+    def calc_tangent_rate_array(self, s):
+        """
+        calc tangent derivatives (d2x/ds2, d2y/ds2) for an array of s
+        Parameters
+        ----------
+        s : array_like
+            distances from the start point. `s` outside the data point's
+            range gives NaN.
+        Returns
+        -------
+        ddx : ndarray
+            x second derivatives for given s.
+        ddy : ndarray
+            y second derivatives for given s.
+        """
+        ddx = self.sx.calc_second_derivative_array(s)
+        ddy = self.sy.calc_second_derivative_array(s)
+
+        return ddx, ddy
+
+    def calc_curvature_rate_array(self, s):
+        """
+        calc curvature derivatives dk/ds for an array of s
+        Parameters
+        ----------
+        s : array_like
+            distances from the start point. `s` outside the data point's
+            range gives NaN.
+        Returns
+        -------
+        dk : ndarray
+            curvature derivatives for given s.
+        """
+        dx = self.sx.calc_first_derivative_array(s)
+        ddx = self.sx.calc_second_derivative_array(s)
+        dddx = self.sx.calc_third_derivative_array(s)
+        dy = self.sy.calc_first_derivative_array(s)
+        ddy = self.sy.calc_second_derivative_array(s)
+        dddy = self.sy.calc_third_derivative_array(s)
+        norm2 = dx ** 2 + dy ** 2
+        dk = (dddy * dx - dddx * dy) / norm2 ** (3 / 2) - \
+            3.0 * (ddy * dx - ddx * dy) * (dx * ddx + dy * ddy) / \
+            norm2 ** (5 / 2)
+        return dk
+
+    def calc_frame_array(self, s):
+        """
+        calc everything the Frenet to global transform needs for an array
+        of s with a single segment search per axis
+        Parameters
+        ----------
+        s : array_like
+            distances from the start point. `s` outside the data point's
+            range gives NaN.
+        Returns
+        -------
+        x, y : ndarray
+            positions for given s.
+        yaw : ndarray
+            yaw angles (tangent vector) for given s.
+        sigma, sigma_d : ndarray
+            tangent length |r'(s)| and its derivative.
+        k, dk : ndarray
+            curvatures and their derivatives dk/ds.
+        """
+        x, dx, ddx, dddx = self.sx.calc_derivatives_array(s)
+        y, dy, ddy, dddy = self.sy.calc_derivatives_array(s)
+        sigma = np.hypot(dx, dy)
+        sigma_d = (dx * ddx + dy * ddy) / sigma
+        cross = ddy * dx - ddx * dy
+        k = cross / sigma ** 3
+        dk = (dddy * dx - dddx * dy) / sigma ** 3 - \
+            3.0 * cross * sigma_d / sigma ** 4
+
+        return x, y, np.arctan2(dy, dx), sigma, sigma_d, k, dk
+
+    def calc_yaw_array(self, s):
+        """
+        calc yaws for an array of s
+        Parameters
+        ----------
+        s : array_like
+            distances from the start point. `s` outside the data point's
+            range gives NaN.
+        Returns
+        -------
+        yaw : ndarray
+            yaw angles (tangent vector) for given s.
+        """
+        dx = self.sx.calc_first_derivative_array(s)
+        dy = self.sy.calc_first_derivative_array(s)
+        yaw = np.arctan2(dy, dx)
+        return yaw
+
 
 def calc_spline_course(x, y, ds=0.1):
     sp = CubicSpline2D(x, y)
-    s = list(np.arange(0, sp.s[-1], ds))
+    s = np.arange(0, sp.s[-1], ds)
 
-    rx, ry, ryaw, rk = [], [], [], []
-    for i_s in s:
-        ix, iy = sp.calc_position(i_s)
-        rx.append(ix)
-        ry.append(iy)
-        ryaw.append(sp.calc_yaw(i_s))
-        rk.append(sp.calc_curvature(i_s))
+    rx, ry = sp.calc_position_array(s)
+    ryaw = sp.calc_yaw_array(s)
+    rk = sp.calc_curvature_array(s)
 
-    return rx, ry, ryaw, rk, s
+    return rx.tolist(), ry.tolist(), ryaw.tolist(), rk.tolist(), s.tolist()
 
 
 def main_1d():
@@ -0,0 +1,304 @@
+"""
+Multi-agent Frenet optimal trajectory planner
+
+FleetPlanner plans one cycle for a whole fleet of vehicles on shared
+reference lines with batched arrays: the lattices of all agents are
+built in one calc_frenet_paths call, and every search step converts and
+checks the next candidates of all agents still searching at once.
+
+Agents are planned by priority, their order in the state arrays. An
+agent's path must stay clear of the static obstacles and, at every time
+step, of the paths chosen by the agents ahead of it. All agents first
+pick their best feasible candidate independently, then the selected
+paths are checked against each other on a time-sliced ObstacleGrid, and
+every agent whose path conflicts with a higher-priority one searches on
+from where it stopped, now also avoiding those paths, until no conflict
+is left. Candidates are only ever skipped, so this always terminates.
+
+usage:
+    python fleet_planner.py -n 200
+"""
+
+import argparse
+import pathlib
+import sys
+import time
+
+import numpy as np
+
+sys.path.append(str(pathlib.Path(__file__).parent))
+
+import frenet_optimal_trajectory as fot
+
+STATE_FIELDS = ("s0", "c_speed", "c_accel", "c_d", "c_d_d", "c_d_dd")
+
+
+class FleetPlanner:
+    """
+    courses: one CubicSpline2D or ReferenceLine shared by every agent, or
+        a list of them, selected per agent with the `course` argument of
+        plan
+    ob: static obstacles, as for frenet_optimal_planning
+    config: PlannerConfig shared by every agent, the module parameters at
+        construction if None
+    """
+
+    def __init__(self, courses, ob=None, config=None):
+        self.courses = courses if isinstance(courses, (list, tuple)) \
+            else [courses]
+        self.config = fot.PlannerConfig.from_globals() if config is None \
+            else config
+        self.lattice = self.config.lattice()
+        self.ob = None
+        self.ob_grid = fot.ObstacleGrid(np.zeros((0, 2)),
+                                        self.config.robot_radius)
+        if ob is not None:
+            self.set_obstacles(ob)
+
+    def set_obstacles(self, ob):
+        """
+        update the static obstacle index, only rebuilt if `ob` changed
+        """
+        if self.ob is None or not np.array_equal(self.ob, ob):
+            self.ob = np.array(ob, dtype=float)
+            self.ob_grid = fot.ObstacleGrid(self.ob,
+                                            self.config.robot_radius)
+
+    @fot.profiled_cycle
+    def plan(self, s0, c_speed, c_accel, c_d, c_d_d, c_d_dd, course=None,
+             independent=False):
+        """
+        one planning cycle for every agent, the state arguments are
+        arrays with one entry per agent in priority order
+        course: index into `courses` per agent, all 0 if None
+        independent: plan every agent on its own, ignoring the paths of
+            the others, e.g. for vehicles of separate simulations
+        return: a FrenetPath or None per agent
+        """
+        s0 = np.atleast_1d(np.asarray(s0, dtype=float))
+        n_agent = len(s0)
+        if n_agent == 0:
+            return []
+        if len(self.lattice) == 0:
+            return [None] * n_agent
+        paths = fot.calc_frenet_paths(c_speed, c_accel, c_d, c_d_d, c_d_dd,
+                                      s0, lattice=self.lattice,
+                                      config=self.config)
+        search = _FleetSearch(paths, n_agent, self.courses, self.ob_grid,
+                              np.zeros(n_agent, dtype=np.int64)
+                              if course is None else np.asarray(course),
+                              self.config)
+
+        search.advance(np.arange(n_agent))
+        while not independent:
+            conflict = search.find_conflicts()
+            if len(conflict) == 0:
+                break
+            search.advance(conflict, *search.selection_grid())
+
+        return [None if row < 0 else paths.to_frenet_path(row)
+                for row in search.selected]
+
+
+class _FleetSearch:
+    """
+    best-first search state of one fleet cycle: the candidates of every
+    agent in cost order, a cursor per agent into that order and the
+    static check result of every candidate converted so far
+    """
+
+    def __init__(self, paths, n_agent, courses, ob_grid, course, config):
+        self.paths = paths
+        self.config = config
+        self.n_agent = n_agent
+        self.n_lattice = len(paths) // n_agent
+        self.courses = courses
+        self.ob_grid = ob_grid
+        self.course = course
+
+        # candidates of each agent by increasing cost, the later
+        # candidate first on a tie, as in find_best_path
+        row = np.arange(len(paths))
+        order = np.lexsort((-row, paths.cf, row // self.n_lattice))
+        self.order = order.reshape(n_agent, self.n_lattice)
+        self.cursor = np.zeros(n_agent, dtype=np.int64)
+        self.selected = np.full(n_agent, -1)
+        self.static_ok = np.full(len(paths), -1, dtype=np.int8)
+        self.static_ok[~paths.limits_ok] = 0
+
+    def check_static(self, rows):
+        """
+        convert the not yet seen candidates among `rows` to global
+        coordinates and check them against the limits and static obstacles
+        """
+        rows = np.unique(rows[self.static_ok[rows] < 0])
+        for i, csp in enumerate(self.courses):
+            index = rows[self.course[rows // self.n_lattice] == i]
+            if len(index) == 0:
+                continue
+            sub = fot.calc_global_paths(self.paths.take(index), csp)
+            self.paths.put(index, sub)
+            self.static_ok[index] = fot.check_paths(sub, self.ob_grid,
+                                                    self.config)
+
+    def check_agents(self, rows, grid, grid_agent):
+        """
+        True for candidates clear of the paths in `grid` of every agent
+        ahead of the candidate's own agent
+        grid_agent: agent of every path in `grid`
+        """
+        x, y = self.paths.x[rows], self.paths.y[rows]
+        time_index = np.arange(x.shape[1])[None, :]
+        point, owner, _ = grid.query_pairs(x, y, time_index)
+        point_row = point // x.shape[1]
+        ahead = grid_agent[owner] < rows[point_row] // self.n_lattice
+        ok = np.ones(len(rows), dtype=bool)
+        ok[point_row[ahead]] = False
+        return ok
+
+    def advance(self, agents, grid=None, grid_agent=None):
+        """
+        select the first candidate at or after each agent's cursor that
+        passes the static checks and, if `grid` is given, clears the
+        higher-priority paths in it. Batches double like find_best_path.
+        """
+        batch = self.config.best_first_batch
+        while len(agents) > 0:
+            pos = self.cursor[agents, None] + np.arange(batch)
+            inside = pos < self.n_lattice
+            rows = self.order[agents[:, None],
+                              np.minimum(pos, self.n_lattice - 1)]
+            self.check_static(rows[inside])
+            ok = inside & (self.static_ok[rows] == 1)
+            if grid is not None and np.any(ok):
+                ok[ok] = self.check_agents(rows[ok], grid, grid_agent)
+
+            found = np.any(ok, axis=1)
+            first = np.argmax(ok, axis=1)
+            self.cursor[agents[found]] += first[found]
+            self.selected[agents[found]] = rows[found, first[found]]
+
+            self.cursor[agents[~found]] += batch
+            exhausted = ~found & (self.cursor[agents] >= self.n_lattice)
+            self.selected[agents[exhausted]] = -1
+            agents = agents[~found & ~exhausted]
+            batch *= 2
+
+    def selection_grid(self):
+        """
+        time-sliced obstacle index of the selected paths, two robot radii
+        wide so that vehicle discs must not overlap, and the agent of
+        every path in it
+        """
+        rows = self.selected[self.selected >= 0]
+        grid = fot.ObstacleGrid(
+            np.stack([self.paths.x[rows], self.paths.y[rows]], axis=-1),
+            2.0 * self.config.robot_radius)
+        return grid, rows // self.n_lattice
+
+    def find_conflicts(self):
+        """
+        agents whose selected path comes too close to the selected path
+        of a higher-priority agent
+        """
+        rows = self.selected[self.selected >= 0]
+        if len(rows) < 2:
+            return np.zeros(0, dtype=np.int64)
+        ok = self.check_agents(rows, *self.selection_grid())
+        return rows[~ok] // self.n_lattice
+
+
+def run_fleet_simulation(wx, wy, states, ob=(), sim_loop=fot.SIM_LOOP,
+                         config=None):
+    """
+    Headless closed-loop run of a fleet along one course, see
+    frenet_optimal_trajectory.run_simulation.
+    states: dict of per-agent arrays for the keys of STATE_FIELDS
+    config: PlannerConfig of the fleet, the module parameters if None
+    return: dict with each agent's outcome ("goal", "no_path" or
+        "timeout") and finishing cycle, and the planning latency [s] and
+        number of active agents of every cycle
+    """
+    tx, ty, _, _, csp = fot.generate_target_course(wx, wy)
+    planner = FleetPlanner(csp, np.reshape(ob, (-1, 2)), config)
+    state = {key: np.array(states[key], dtype=float) for key in STATE_FIELDS}
+    n_agent = len(state["s0"])
+
+    status = np.full(n_agent, "timeout", dtype=object)
+    finished = np.full(n_agent, -1)
+    active = np.arange(n_agent)
+    latency, n_active = [], []
+    for i in range(sim_loop):
+        if len(active) == 0:
+            break
+        start = time.perf_counter()
+        paths = planner.plan(**{key: state[key][active]
+                                for key in STATE_FIELDS})
+        latency.append(time.perf_counter() - start)
+        n_active.append(len(active))
+
+        keep = np.ones(len(active), dtype=bool)
+        for j, (agent, path) in enumerate(zip(active, paths)):
+            if path is None or len(path.x) < 2:
+                status[agent], finished[agent], keep[j] = "no_path", i, False
+                continue
+            for key, name in zip(STATE_FIELDS,
+                                 ("s", "s_d", "s_dd", "d", "d_d", "d_dd")):
+                state[key][agent] = getattr(path, name)[1]
+            if np.hypot(path.x[1] - tx[-1], path.y[1] - ty[-1]) <= 1.0:
+                status[agent], finished[agent], keep[j] = "goal", i, False
+        active = active[keep]
+
+    return {"status": status.tolist(), "finished": finished.tolist(),
+            "latency": latency, "n_active": n_active}
+
+
+def make_fleet(n, length, seed=0, gap=10.0, lane_width=4.5):
+    """
+    n agents on distinct slots, `gap` apart along the first half of a
+    course of the given length and `lane_width` apart across it
+    """
+    rng = np.random.default_rng(seed)
+    lanes = np.arange(-1, 2) * lane_width
+    slots = np.arange(0.0, 0.5 * length, gap)
+    if n > len(slots) * len(lanes):
+        raise ValueError("course too short for %d agents" % n)
+    slot = np.sort(rng.choice(len(slots) * len(lanes), n, replace=False))
+    return {
+        # agents further ahead first, they have priority
+        "s0": slots[slot // len(lanes)][::-1],
+        "c_speed": rng.uniform(2.0, fot.TARGET_SPEED, n),
+        "c_accel": np.zeros(n),
+        "c_d": lanes[slot % len(lanes)][::-1],
+        "c_d_d": np.zeros(n),
+        "c_d_dd": np.zeros(n),
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[1])
+    parser.add_argument("-n", "--agents", type=int, default=50)
+    parser.add_argument("--length", type=float, default=1000.0,
+                        help="course length [m]")
+    parser.add_argument("--sim-loop", type=int, default=100)
+    parser.add_argument("--seed", type=int, default=0)
+    args = parser.parse_args()
+
+    wx = np.linspace(0.0, args.length, 11)
+    wy = 10.0 * np.sin(wx / args.length * 4.0 * np.pi)
+    states = make_fleet(args.agents, args.length, args.seed)
+    result = run_fleet_simulation(wx, wy, states, sim_loop=args.sim_loop)
+
+    latency = np.array(result["latency"])
+    status = np.array(result["status"])
+    print("%d agents, %d cycles, latency median %.1f ms max %.1f ms, "
+          "%.2f ms per agent-cycle" % (
+              args.agents, len(latency), np.median(latency) * 1e3,
+              latency.max() * 1e3,
+              latency.sum() * 1e3 / max(sum(result["n_active"]), 1)))
+    for name in ("goal", "no_path", "timeout"):
+        print("  %-8s %d" % (name, np.sum(status == name)))
+
+
+if __name__ == '__main__':
+    main()
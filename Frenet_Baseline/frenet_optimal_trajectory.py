@@ -9,15 +9,21 @@ Ref:
 """
 
 import numpy as np
-import matplotlib.pyplot as plt
-import copy
+import dataclasses
+import functools
 import math
+import threading
+import time
 import sys
 import pathlib
 sys.path.append(str(pathlib.Path(__file__).parent.parent))
 
-from quintic_polynomials_planner import QuinticPolynomial
+from quintic_polynomials_planner import PolynomialBatch, \
+    QuinticPolynomialBatch, calc_quintic_boundary_inverse, \
+    stack_boundary_inverses, BOUNDARY_CACHE_SIZE
 import cubic_spline_planner
+import frenet_renderer
+from reference_line import ReferenceLine
 
 SIM_LOOP = 500
 
@@ -34,6 +40,13 @@ TARGET_SPEED = 30.0 / 3.6  # target speed [m/s]
 D_T_S = 5.0 / 3.6  # target speed sampling length [m/s]
 N_S_SAMPLE = 1  # sampling number of target speed
 ROBOT_RADIUS = 2.0  # robot radius [m]
+OBSTACLE_WINDOW = 5  # obstacle time slices per broad-phase box
+OBSTACLE_DENSE_CELLS = 1 << 16  # largest dense broad-phase table [cell]
+BEST_FIRST_BATCH = 4  # first batch size of the best-first search
+REFERENCE_WINDOW_MARGIN = 30.0  # reference line kept ahead of the lattice [m]
+PROJECTION_SAMPLE_DS = 1.0  # course sampling of the cold-start search [m]
+PROJECTION_MAX_ITER = 10  # Newton iterations of the projection
+PROJECTION_TOL = 1e-9  # projection convergence tolerance [m]
 
 # cost weights
 K_J = 0.1
@@ -45,45 +58,98 @@ K_LON = 1.0
 show_animation = True
 
 
-class QuarticPolynomial:
-
-    def __init__(self, xs, vxs, axs, vxe, axe, time):
-        # calc coefficient of quartic polynomial
-
-        self.a0 = xs
-        self.a1 = vxs
-        self.a2 = axs / 2.0
-
-        A = np.array([[3 * time ** 2, 4 * time ** 3],
-                      [6 * time, 12 * time ** 2]])
-        b = np.array([vxe - self.a1 - 2 * self.a2 * time,
-                      axe - 2 * self.a2])
-        x = np.linalg.solve(A, b)
-
-        self.a3 = x[0]
-        self.a4 = x[1]
-
-    def calc_point(self, t):
-        xt = self.a0 + self.a1 * t + self.a2 * t ** 2 + \
-             self.a3 * t ** 3 + self.a4 * t ** 4
-
-        return xt
-
-    def calc_first_derivative(self, t):
-        xt = self.a1 + 2 * self.a2 * t + \
-             3 * self.a3 * t ** 2 + 4 * self.a4 * t ** 3
-
-        return xt
-
-    def calc_second_derivative(self, t):
-        xt = 2 * self.a2 + 6 * self.a3 * t + 12 * self.a4 * t ** 2
-
-        return xt
-
-    def calc_third_derivative(self, t):
-        xt = 6 * self.a3 + 24 * self.a4 * t
-
-        return xt
+@dataclasses.dataclass(frozen=True)
+class PlannerConfig:
+    """
+    Immutable planner parameters of one vehicle type. The fields are the
+    module parameters above in lower case, defaulting to their values at
+    import. Every planning function takes an optional config and reads
+    the module parameters as they are at call time when it is None.
+    """
+
+    max_speed: float = MAX_SPEED
+    max_accel: float = MAX_ACCEL
+    max_curvature: float = MAX_CURVATURE
+    max_road_width: float = MAX_ROAD_WIDTH
+    d_road_w: float = D_ROAD_W
+    dt: float = DT
+    max_t: float = MAX_T
+    min_t: float = MIN_T
+    target_speed: float = TARGET_SPEED
+    d_t_s: float = D_T_S
+    n_s_sample: int = N_S_SAMPLE
+    robot_radius: float = ROBOT_RADIUS
+    best_first_batch: int = BEST_FIRST_BATCH
+    reference_window_margin: float = REFERENCE_WINDOW_MARGIN
+    k_j: float = K_J
+    k_t: float = K_T
+    k_d: float = K_D
+    k_lat: float = K_LAT
+    k_lon: float = K_LON
+
+    @classmethod
+    def from_globals(cls):
+        """
+        the current module parameters, which scripts may have reassigned
+        """
+        module = sys.modules[__name__]
+        return cls(**{field.name: getattr(module, field.name.upper())
+                      for field in dataclasses.fields(cls)})
+
+    def lattice(self):
+        """
+        the (cached) FrenetLattice of the sampling parameters
+        """
+        return calc_lattice(self.max_road_width, self.d_road_w, self.min_t,
+                            self.max_t, self.dt, self.target_speed,
+                            self.d_t_s, self.n_s_sample)
+
+
+# opt-in stage timing and counters, assign an
+# instrumentation.PlannerProfiler to record them
+profiler = None
+
+
+def profiled(stage):
+    """
+    decorator timing every call of a planner stage on the active profiler,
+    a single `is None` test while profiling is off
+    """
+    def decorator(func):
+        @functools.wraps(func)
+        def wrapper(*args, **kwargs):
+            if profiler is None:
+                return func(*args, **kwargs)
+            with profiler.stage(stage):
+                return func(*args, **kwargs)
+        return wrapper
+    return decorator
+
+
+def profiled_cycle(func):
+    """
+    decorator recording every call of a planning entry point as one cycle
+    """
+    @functools.wraps(func)
+    def wrapper(*args, **kwargs):
+        if profiler is None:
+            return func(*args, **kwargs)
+        with profiler.cycle():
+            return func(*args, **kwargs)
+    return wrapper
+
+
+@functools.lru_cache(maxsize=BOUNDARY_CACHE_SIZE)
+def calc_quartic_boundary_inverse(time):
+    """
+    Inverse of the end-point boundary matrix of a quartic polynomial,
+    cached per horizon time like calc_quintic_boundary_inverse.
+    """
+    A = np.array([[3 * time ** 2, 4 * time ** 3],
+                  [6 * time, 12 * time ** 2]])
+    A_inv = np.linalg.inv(A)
+    A_inv.setflags(write=False)
+    return A_inv
 
 
 class FrenetPath:
@@ -105,151 +171,1070 @@ class FrenetPath:
         self.x = []
         self.y = []
         self.yaw = []
+        self.v = []
         self.ds = []
         self.c = []
 
 
-def calc_frenet_paths(c_speed, c_accel, c_d, c_d_d, c_d_dd, s0):
-    frenet_paths = []
-
-    # generate path to each offset goal
-    for di in np.arange(-MAX_ROAD_WIDTH, MAX_ROAD_WIDTH, D_ROAD_W):
-
-        # Lateral motion planning
-        for Ti in np.arange(MIN_T, MAX_T, DT):
-            fp = FrenetPath()
-
-            # lat_qp = quintic_polynomial(c_d, c_d_d, c_d_dd, di, 0.0, 0.0, Ti)
-            lat_qp = QuinticPolynomial(c_d, c_d_d, c_d_dd, di, 0.0, 0.0, Ti)
-
-            fp.t = [t for t in np.arange(0.0, Ti, DT)]
-            fp.d = [lat_qp.calc_point(t) for t in fp.t]
-            fp.d_d = [lat_qp.calc_first_derivative(t) for t in fp.t]
-            fp.d_dd = [lat_qp.calc_second_derivative(t) for t in fp.t]
-            fp.d_ddd = [lat_qp.calc_third_derivative(t) for t in fp.t]
-
-            # Longitudinal motion planning (Velocity keeping)
-            for tv in np.arange(TARGET_SPEED - D_T_S * N_S_SAMPLE,
-                                TARGET_SPEED + D_T_S * N_S_SAMPLE, D_T_S):
-                tfp = copy.deepcopy(fp)
-                lon_qp = QuarticPolynomial(s0, c_speed, c_accel, tv, 0.0, Ti)
-
-                tfp.s = [lon_qp.calc_point(t) for t in fp.t]
-                tfp.s_d = [lon_qp.calc_first_derivative(t) for t in fp.t]
-                tfp.s_dd = [lon_qp.calc_second_derivative(t) for t in fp.t]
-                tfp.s_ddd = [lon_qp.calc_third_derivative(t) for t in fp.t]
-
-                Jp = sum(np.power(tfp.d_ddd, 2))  # square of jerk
-                Js = sum(np.power(tfp.s_ddd, 2))  # square of jerk
-
-                # square of diff from target speed
-                ds = (TARGET_SPEED - tfp.s_d[-1]) ** 2
-
-                tfp.cd = K_J * Jp + K_T * Ti + K_D * tfp.d[-1] ** 2
-                tfp.cv = K_J * Js + K_T * Ti + K_D * ds
-                tfp.cf = K_LAT * tfp.cd + K_LON * tfp.cv
-
-                frenet_paths.append(tfp)
-
-    return frenet_paths
-
-
-def calc_global_paths(fplist, csp):
-    for fp in fplist:
-
-        # calc global positions
-        for i in range(len(fp.s)):
-            ix, iy = csp.calc_position(fp.s[i])
-            if ix is None:
-                break
-            i_yaw = csp.calc_yaw(fp.s[i])
-            di = fp.d[i]
-            fx = ix + di * math.cos(i_yaw + math.pi / 2.0)
-            fy = iy + di * math.sin(i_yaw + math.pi / 2.0)
-            fp.x.append(fx)
-            fp.y.append(fy)
-
-        # calc yaw and ds
-        for i in range(len(fp.x) - 1):
-            dx = fp.x[i + 1] - fp.x[i]
-            dy = fp.y[i + 1] - fp.y[i]
-            fp.yaw.append(math.atan2(dy, dx))
-            fp.ds.append(math.hypot(dx, dy))
-
-        fp.yaw.append(fp.yaw[-1])
-        fp.ds.append(fp.ds[-1])
-
-        # calc curvature
-        for i in range(len(fp.yaw) - 1):
-            fp.c.append((fp.yaw[i + 1] - fp.yaw[i]) / fp.ds[i])
-
-    return fplist
-
-
-def check_collision(fp, ob):
-    for i in range(len(ob[:, 0])):
-        d = [((ix - ob[i, 0]) ** 2 + (iy - ob[i, 1]) ** 2)
-             for (ix, iy) in zip(fp.x, fp.y)]
-
-        collision = any([di <= ROBOT_RADIUS ** 2 for di in d])
-
-        if collision:
-            return False
-
-    return True
-
-
-def check_paths(fplist, ob):
-    ok_ind = []
-    for i, _ in enumerate(fplist):
-        if any([v > MAX_SPEED for v in fplist[i].s_d]):  # Max speed check
-            continue
-        elif any([abs(a) > MAX_ACCEL for a in
-                  fplist[i].s_dd]):  # Max accel check
-            continue
-        elif any([abs(c) > MAX_CURVATURE for c in
-                  fplist[i].c]):  # Max curvature check
-            continue
-        elif not check_collision(fplist[i], ob):
-            continue
-
-        ok_ind.append(i)
-
-    return [fplist[i] for i in ok_ind]
-
-
-def frenet_optimal_planning(csp, s0, c_speed, c_accel, c_d, c_d_d, c_d_dd, ob):
-    fplist = calc_frenet_paths(c_speed, c_accel, c_d, c_d_d, c_d_dd, s0)
-    fplist = calc_global_paths(fplist, csp)
-    fplist = check_paths(fplist, ob)
+class FrenetCandidates:
+    """
+    Structure-of-arrays store for a whole lattice of candidate paths.
+    Every per-point field is one (n_candidates, n_time) array. Samples past
+    a candidate's own horizon (n_point) or past the end of the reference
+    line (n_global) are NaN, so they drop out of every limit check.
+    """
+
+    FRENET_FIELDS = ("d", "d_d", "d_dd", "d_ddd", "s", "s_d", "s_dd", "s_ddd")
+    GLOBAL_FIELDS = ("x", "y", "yaw", "v", "ds", "c")
+    # per-candidate costs, and the speed and accel limits checked from the
+    # polynomial coefficients by check_limits
+    ROW_FIELDS = ("cd", "cv", "cf", "limits_ok")
+
+    def __init__(self, t, n_point, **fields):
+        self.t = t
+        self.n_point = n_point
+        self.n_global = np.zeros_like(n_point)
+        for name in self.FRENET_FIELDS + self.ROW_FIELDS:
+            setattr(self, name, fields[name])
+        for name in self.GLOBAL_FIELDS:
+            setattr(self, name, fields.get(
+                name, np.full((len(n_point), len(t)), np.nan)))
+
+    def __len__(self):
+        return len(self.n_point)
+
+    def take(self, index):
+        """
+        return a new store holding only the candidates in `index`
+        """
+        sub = FrenetCandidates(
+            self.t, self.n_point[index],
+            **{name: getattr(self, name)[index] for name in
+               self.FRENET_FIELDS + self.GLOBAL_FIELDS + self.ROW_FIELDS})
+        sub.n_global = self.n_global[index]
+        return sub
+
+    def put(self, index, other):
+        """
+        copy the global fields of `other` into the candidates in `index`
+        """
+        for name in self.GLOBAL_FIELDS:
+            getattr(self, name)[index] = getattr(other, name)
+        self.n_global[index] = other.n_global
+
+    def to_frenet_path(self, i):
+        """
+        build a FrenetPath holding candidate `i`
+        """
+        n = self.n_point[i]
+        n_global = self.n_global[i]
+
+        fp = FrenetPath()
+        fp.t = self.t[:n].tolist()
+        for name in self.FRENET_FIELDS:
+            setattr(fp, name, getattr(self, name)[i, :n].tolist())
+        for name in ("x", "y", "yaw", "v", "c"):
+            setattr(fp, name, getattr(self, name)[i, :n_global].tolist())
+        fp.ds = self.ds[i, :max(n_global - 1, 0)].tolist()
+        fp.cd = float(self.cd[i])
+        fp.cv = float(self.cv[i])
+        fp.cf = float(self.cf[i])
+
+        return fp
+
+
+class ObstacleGrid:
+    """
+    Uniform grid index over obstacle points, built once per cycle.
+    Cells are `radius` wide, so every obstacle within `radius` of a point
+    lies in the 3x3 block of cells around that point. Only the obstacles
+    are stored, sorted by cell, so the index grows with their number and
+    not with the area they spread over.
+    ob: (n, 2) static obstacle points, or (n, n_slice, 2) obstacle
+        trajectories sampled every DT from the start of the cycle (NaN
+        where an obstacle is absent). Each time slice is bucketed
+        separately, a point at time index j is only tested against slice
+        j, and obstacles hold their last position after the last slice.
+    window: time slices per bounding-box query window, see count_in_box
+    """
+
+    def __init__(self, ob, radius, window=OBSTACLE_WINDOW):
+        self.radius = radius
+        self.cell = max(radius, 1e-6)
+        ob = np.asarray(ob, dtype=float)
+        if ob.ndim == 3:
+            self.n_slice = max(ob.shape[1], 1)
+            time_slice = np.repeat(np.arange(ob.shape[1]), ob.shape[0])
+            owner = np.tile(np.arange(ob.shape[0]), ob.shape[1])
+            ob = ob.transpose(1, 0, 2).reshape(-1, 2)
+        else:
+            self.n_slice = 1
+            ob = ob.reshape(-1, 2)
+            time_slice = np.zeros(len(ob), dtype=np.int64)
+            owner = np.arange(len(ob))
+        present = ~np.any(np.isnan(ob), axis=1)
+        ob, time_slice = ob[present], time_slice[present]
+        owner = owner[present]
+
+        if len(ob) == 0:
+            self.origin = np.zeros(2)
+            self.shape = (0, 0)
+        else:
+            self.origin = ob.min(axis=0)
+            self.shape = tuple(self.__cell_index(ob).max(axis=0) + 1)
+
+        # obstacles sorted by (time slice, row, column) cell id, so one
+        # cell row of one slice is one contiguous slice of self.ob
+        k = self.__cell_index(ob)
+        cell_id = (time_slice * self.shape[0] + k[:, 0]) * self.shape[1] + \
+            k[:, 1]
+        order = np.argsort(cell_id, kind="stable")
+        self.ob = ob[order]
+        self.owner = owner[order]  # obstacle number of every entry
+        self.cell_id = cell_id[order]
+        self.k = k[order]  # cell row and column of every entry
+        self.window = window
+        self.n_window = (self.n_slice - 1) // window + 1
+        self.k_window = time_slice[order] // window  # of every entry
+
+    def __len__(self):
+        return len(self.ob)
+
+    def __cell_index(self, p):
+        return np.floor((p - self.origin) / self.cell).astype(np.int64)
+
+    def time_window(self, time_index):
+        """
+        query window of points at `time_index`
+        """
+        return np.minimum(time_index, self.n_slice - 1) // self.window
+
+    def count_in_box(self, x_min, y_min, x_max, y_max, window=0):
+        """
+        number of obstacles of the time slices in `window` in the cells
+        overlapping each box, an upper bound on the obstacles inside the
+        box over that time. NaN boxes count as empty.
+        window: time window of every box, see time_window
+        """
+        *box, window = np.broadcast_arrays(x_min, y_min, x_max, y_max,
+                                           window)
+        box = np.stack(box, axis=-1).astype(float)
+        empty = np.any(np.isnan(box), axis=-1)
+        box[empty] = 0.0
+        lo = self.__cell_index(box[..., :2])
+        hi = self.__cell_index(box[..., 2:]) + 1
+
+        # summed-area tables over the region the boxes cover, or over its
+        # occupied rows and columns only if that is large, so their size
+        # is bounded by the obstacles near the boxes however far the
+        # others spread, sat[w, i, j] = obstacles of window w in the
+        # first i rows x j columns
+        if np.all(empty):
+            k_lo = k_hi = np.zeros(2, dtype=np.int64)
+        else:
+            k_lo, k_hi = lo[~empty].min(axis=0), hi[~empty].max(axis=0)
+        inside = np.all((self.k >= k_lo) & (self.k < k_hi), axis=1)
+        k, k_window = self.k[inside], self.k_window[inside]
+        if np.prod(k_hi - k_lo) * self.n_window <= OBSTACLE_DENSE_CELLS:
+            rows, i = np.arange(k_lo[0], k_hi[0]), k[:, 0] - k_lo[0]
+            cols, j = np.arange(k_lo[1], k_hi[1]), k[:, 1] - k_lo[1]
+        else:
+            rows, i = np.unique(k[:, 0], return_inverse=True)
+            cols, j = np.unique(k[:, 1], return_inverse=True)
+        shape = (self.n_window, len(rows) + 1, len(cols) + 1)
+        sat = np.bincount(np.ravel_multi_index((k_window, i + 1, j + 1),
+                                               shape),
+                          minlength=np.prod(shape))
+        sat = sat.reshape(shape).cumsum(1).cumsum(2)
+
+        i0, i1 = [np.searchsorted(rows, c[..., 0]) for c in (lo, hi)]
+        j0, j1 = [np.searchsorted(cols, c[..., 1]) for c in (lo, hi)]
+        count = sat[window, i1, j1] - sat[window, i0, j1] - \
+            sat[window, i1, j0] + sat[window, i0, j0]
+        return np.where(empty, 0, count)
+
+    def query_points(self, x, y, time_index=None):
+        """
+        return a boolean array, True for points within `radius` of an
+        obstacle, and the number of point-obstacle distances evaluated
+        time_index: time step of every point for obstacle trajectories,
+            ignored for static obstacles
+        """
+        hit = np.zeros(np.size(x), dtype=bool)
+        point, _, n_pair = self.query_pairs(x, y, time_index)
+        hit[point] = True
+
+        return hit, n_pair
+
+    def query_pairs(self, x, y, time_index=None):
+        """
+        every (point, obstacle) pair within `radius`, as the flat index of
+        the point and the obstacle number (row of `ob`), and the number of
+        point-obstacle distances evaluated
+        """
+        shape = np.shape(x)
+        x = np.asarray(x, dtype=float).ravel()
+        y = np.asarray(y, dtype=float).ravel()
+        if len(self.ob) == 0:
+            empty = np.zeros(0, dtype=np.int64)
+            return empty, empty, 0
+
+        point = np.flatnonzero(~(np.isnan(x) | np.isnan(y)))
+        if self.n_slice == 1 or time_index is None:
+            time_slice = 0
+        else:
+            time_slice = np.minimum(
+                np.broadcast_to(time_index, shape).ravel()[point],
+                self.n_slice - 1)
+        k = self.__cell_index(np.column_stack([x[point], y[point]]))
+        ky_lo = np.clip(k[:, 1] - 1, 0, self.shape[1] - 1)
+        ky_hi = np.clip(k[:, 1] + 1, 0, self.shape[1] - 1)
+
+        # each neighbouring cell row is one contiguous slice of self.ob
+        starts, stops, owners = [], [], []
+        for dx in (-1, 0, 1):
+            row = k[:, 0] + dx
+            ok = (row >= 0) & (row < self.shape[0]) & \
+                (k[:, 1] + 1 >= 0) & (k[:, 1] - 1 < self.shape[1])
+            base = (np.broadcast_to(time_slice, row.shape)[ok] *
+                    self.shape[0] + row[ok]) * self.shape[1]
+            starts.append(np.searchsorted(self.cell_id, base + ky_lo[ok],
+                                          side="left"))
+            stops.append(np.searchsorted(self.cell_id, base + ky_hi[ok],
+                                         side="right"))
+            owners.append(point[ok])
+        start = np.concatenate(starts)
+        length = np.concatenate(stops) - start
+        owner = np.concatenate(owners)
+
+        # expand the slices into (point, obstacle) pairs
+        n_pair = int(length.sum())
+        offset = np.repeat(np.cumsum(length) - length, length)
+        ob_idx = np.repeat(start, length) + np.arange(n_pair) - offset
+        pt_idx = np.repeat(owner, length)
+
+        d = (x[pt_idx] - self.ob[ob_idx, 0]) ** 2 + \
+            (y[pt_idx] - self.ob[ob_idx, 1]) ** 2
+        close = d <= self.radius ** 2
+
+        return pt_idx[close], self.owner[ob_idx[close]], n_pair
+
+
+class QuarticPolynomialBatch(PolynomialBatch):
+    """
+    Quartic polynomials from a start position, speed and accel to an end
+    speed and accel, one per entry of the broadcast boundary conditions
+    A_inv: boundary inverses per entry, looked up from the cache if None
+    """
+
+    def __init__(self, xs, vxs, axs, vxe, axe, time, A_inv=None):
+        xs, vxs, axs, vxe, axe, time = np.broadcast_arrays(
+            *[np.asarray(v, dtype=float) for v in
+              (xs, vxs, axs, vxe, axe, time)])
+        a0 = xs.ravel()
+        a1 = vxs.ravel()
+        a2 = axs.ravel() / 2.0
+        T = time.ravel()
+
+        b = np.stack([vxe.ravel() - a1 - 2 * a2 * T,
+                      axe.ravel() - 2 * a2], axis=-1)
+        if A_inv is None:
+            A_inv = stack_boundary_inverses(calc_quartic_boundary_inverse, T)
+        x = np.einsum("nij,nj->ni", A_inv, b)
+
+        super().__init__(np.column_stack([a0, a1, a2, x]))
+
+
+class FrenetLattice:
+    """
+    Sampling lattice of calc_frenet_paths: one row per sampled (lateral
+    offset D, horizon time T, target speed V) candidate. Everything here
+    depends only on the samples, see calc_lattice.
+    """
+
+    def __init__(self, D, T, V, dt):
+        self.D, self.T, self.V = [np.asarray(a, dtype=float)
+                                  for a in (D, T, V)]
+        self.dt = dt
+
+        # time grid of the longest horizon, shorter ones use a prefix of
+        # it, empty for an empty lattice
+        unique, inverse = np.unique(self.T, return_inverse=True)
+        n_t = np.array([len(np.arange(0.0, ti, dt)) for ti in unique],
+                       dtype=np.int64)
+        self.n_point = n_t[inverse]
+        self.t = np.arange(0.0, np.max(self.T, initial=0.0), dt)
+        self.valid = np.arange(len(self.t))[None, :] < self.n_point[:, None]
+        self.last = self.n_point - 1
+
+        self.quintic_inverse = stack_boundary_inverses(
+            calc_quintic_boundary_inverse, self.T)
+        self.quartic_inverse = stack_boundary_inverses(
+            calc_quartic_boundary_inverse, self.T)
+
+        # the longitudinal profile depends on (T, V) only, its limits are
+        # checked once per distinct pair and looked up through lon_index
+        _, first, self.lon_index = np.unique(
+            np.column_stack([self.T, self.V]), axis=0, return_index=True,
+            return_inverse=True)
+        self.lon_T, self.lon_V = self.T[first], self.V[first]
+        self.lon_t_end = self.t[self.last[first]]
+        self.lon_inverse = self.quartic_inverse[first]
+
+        # shared by every planner and thread using this lattice
+        for a in vars(self).values():
+            if isinstance(a, np.ndarray):
+                a.setflags(write=False)
+
+    @classmethod
+    def from_grid(cls, max_road_width, d_road_w, min_t, max_t, dt,
+                  target_speed, d_t_s, n_s_sample):
+        """
+        the full grid of lateral offset x horizon time x target speed, in
+        the same order as nested loops over (di, Ti, tv)
+        """
+        di = np.arange(-max_road_width, max_road_width, d_road_w)
+        Ti = np.arange(min_t, max_t, dt)
+        tv = np.arange(target_speed - d_t_s * n_s_sample,
+                       target_speed + d_t_s * n_s_sample, d_t_s)
+        lattice = cls(*[g.ravel() for g in
+                        np.meshgrid(di, Ti, tv, indexing="ij")], dt)
+        lattice.axes = (di, Ti, tv)
+        return lattice
+
+    def __len__(self):
+        return len(self.D)
+
+
+@functools.lru_cache(maxsize=8)
+def calc_lattice(max_road_width, d_road_w, min_t, max_t, dt,
+                 target_speed, d_t_s, n_s_sample):
+    """
+    FrenetLattice for one set of sampling parameters, cached so replanning
+    cycles with the same parameters share it
+    """
+    return FrenetLattice.from_grid(max_road_width, d_road_w, min_t, max_t,
+                                   dt, target_speed, d_t_s, n_s_sample)
+
+
+@profiled("calc_frenet_paths")
+def calc_frenet_paths(c_speed, c_accel, c_d, c_d_d, c_d_dd, s0,
+                      lattice=None, config=None):
+    """
+    the lattice of candidates from one Frenet state, or from the states
+    of several vehicles given as equal-length arrays, one block of
+    len(lattice) candidates per vehicle in order
+    lattice: FrenetLattice to sample, the grid of the config if None
+    config: PlannerConfig, the module parameters if None
+    """
+    if config is None:
+        config = PlannerConfig.from_globals()
+    if lattice is None:
+        lattice = config.lattice()
+    D, T, V = lattice.D, lattice.T, lattice.V
+    t, n_point, valid, last = \
+        lattice.t, lattice.n_point, lattice.valid, lattice.last
+    quintic_inverse = lattice.quintic_inverse
+    quartic_inverse = lattice.quartic_inverse
+    lon_t_end, lon_inverse = lattice.lon_t_end, lattice.lon_inverse
+
+    n_agent = np.size(s0)
+    if np.ndim(s0) > 0:
+        c_speed, c_accel, c_d, c_d_d, c_d_dd, s0 = [
+            np.asarray(v, dtype=float).reshape(-1, 1) for v in
+            (c_speed, c_accel, c_d, c_d_d, c_d_dd, s0)]
+        n_point, last = np.tile(n_point, n_agent), np.tile(last, n_agent)
+        valid = np.tile(valid, (n_agent, 1))
+        quintic_inverse = np.tile(quintic_inverse, (n_agent, 1, 1))
+        quartic_inverse = np.tile(quartic_inverse, (n_agent, 1, 1))
+        lon_t_end = np.tile(lon_t_end, n_agent)
+        lon_inverse = np.tile(lon_inverse, (n_agent, 1, 1))
+    n_cand = len(n_point)
+    if n_cand == 0:
+        # e.g. MIN_T >= MAX_T or no target speed samples
+        return FrenetCandidates(
+            t, n_point, limits_ok=np.zeros(0, dtype=bool),
+            **{name: np.zeros((0, len(t))) for name in
+               FrenetCandidates.FRENET_FIELDS},
+            **{name: np.zeros(0) for name in ("cd", "cv", "cf")})
+
+    lat = QuinticPolynomialBatch(c_d, c_d_d, c_d_dd, D, 0.0, 0.0, T,
+                                 A_inv=quintic_inverse)
+    lon = QuarticPolynomialBatch(s0, c_speed, c_accel, V, 0.0, T,
+                                 A_inv=quartic_inverse)
+    T = np.resize(T, n_cand)
+
+    d, d_d, d_dd, d_ddd = lat.evaluate(t, 3)
+    s, s_d, s_dd, s_ddd = lon.evaluate(t, 3)
+
+    Jp = np.sum(np.where(valid, d_ddd, 0.0) ** 2, axis=1)  # square of jerk
+    Js = np.sum(np.where(valid, s_ddd, 0.0) ** 2, axis=1)  # square of jerk
+
+    rows = np.arange(n_cand)
+    # square of diff from target speed
+    ds = (config.target_speed - s_d[rows, last]) ** 2
+
+    cd = config.k_j * Jp + config.k_t * T + config.k_d * d[rows, last] ** 2
+    cv = config.k_j * Js + config.k_t * T + config.k_d * ds
+    cf = config.k_lat * cd + config.k_lon * cv
+    # every candidate is sampled, also those breaking the limits: the
+    # rows are dense and filling them is bound by the allocation, so
+    # sampling only the survivors and scattering them back is slower
+    limits_ok = check_limits(QuarticPolynomialBatch(
+        s0, c_speed, c_accel, lattice.lon_V, 0.0, lattice.lon_T,
+        A_inv=lon_inverse), lon_t_end, config)
+    limits_ok = limits_ok.reshape(-1, len(lattice.lon_T))[
+        :, lattice.lon_index].ravel()
+
+    for a in (d, d_d, d_dd, d_ddd, s, s_d, s_dd, s_ddd):
+        a[~valid] = np.nan
+
+    return FrenetCandidates(t, n_point, d=d, d_d=d_d, d_dd=d_dd,
+                            d_ddd=d_ddd, s=s, s_d=s_d, s_dd=s_dd,
+                            s_ddd=s_ddd, cd=cd, cv=cv, cf=cf,
+                            limits_ok=limits_ok)
+
+
+@profiled("calc_global_paths")
+def calc_global_paths(paths, csp):
+    """
+    Frenet to global transform of every candidate in closed form, from
+    the polynomial derivatives and the reference line's tangent length
+    sigma = |r'(s)|, curvature and their derivatives. A point moves at
+    u = sigma (1 - k d) s_d along the reference tangent and w = d_d across
+    it, in a frame turning at sigma k s_d.
+    """
+    # calc global positions, up to the first sample past the course end
+    ix, iy, i_yaw, sigma, sigma_d, k, dk = csp.calc_frame_array(paths.s)
+    inside = np.cumprod(~np.isnan(ix), axis=1).astype(bool)
+    paths.n_global = np.sum(inside, axis=1)
+    for a in (ix, iy, sigma):
+        a[~inside] = np.nan
+    paths.x = ix + paths.d * np.cos(i_yaw + math.pi / 2.0)
+    paths.y = iy + paths.d * np.sin(i_yaw + math.pi / 2.0)
+
+    # calc velocity and acceleration in the reference frame
+    s_d, s_dd = paths.s_d, paths.s_dd
+    one_minus_kd = 1.0 - k * paths.d
+    u = sigma * one_minus_kd * s_d
+    w = paths.d_d
+    u_d = (sigma_d * one_minus_kd * s_d -
+           sigma * (dk * s_d * paths.d + k * paths.d_d)) * s_d + \
+        sigma * one_minus_kd * s_dd
+    omega = sigma * k * s_d
+    a_t = u_d - omega * w
+    a_n = paths.d_dd + omega * u
+
+    # calc yaw in (-pi, pi], speed and curvature
+    yaw = i_yaw + np.arctan2(w, u)
+    paths.yaw = math.pi - (math.pi - yaw) % (2.0 * math.pi)
+    paths.v = np.hypot(u, w)
+    stopped = paths.v == 0.0
+    with np.errstate(divide="ignore", invalid="ignore"):
+        paths.c = (u * a_n - w * a_t) / paths.v ** 3
+    if np.any(stopped):
+        # the curvature is undefined at a standstill: take that of the
+        # next moving sample, as the original finite differences did, and
+        # 0 for a vehicle standing still to the end
+        n_t = paths.c.shape[1]
+        moving = np.where(paths.v > 0.0, np.arange(n_t), n_t)
+        moving = np.minimum.accumulate(moving[:, ::-1], axis=1)[:, ::-1]
+        c = np.pad(paths.c, ((0, 0), (0, 1)))
+        paths.c[stopped] = np.take_along_axis(c, moving, axis=1)[stopped]
+
+    # calc ds between consecutive points
+    paths.ds[:, :-1] = np.hypot(np.diff(paths.x, axis=1),
+                                np.diff(paths.y, axis=1))
+
+    return paths
+
+
+@profiled("check_collision")
+def check_collision(paths, ob, config=None):
+    """
+    return a boolean array, True for candidates clear of every obstacle
+    ob: an ObstacleGrid, or what it is built from: (n, 2) static obstacle
+        points or (n, n_slice, 2) obstacle trajectories on the DT grid
+    config: PlannerConfig for the robot radius of a new grid, the module
+        parameters if None
+    """
+    if not isinstance(ob, ObstacleGrid):
+        if config is None:
+            config = PlannerConfig.from_globals()
+        ob = ObstacleGrid(ob, config.robot_radius)
+
+    # broad phase: only candidates with obstacles near their bounding box,
+    # one box per time window against the obstacles of that window
+    time_index = np.arange(paths.x.shape[1])
+    window, start = np.unique(ob.time_window(time_index), return_index=True)
+    box = [reduce.reduceat(xy.T, start) + sign * ob.radius
+           for reduce, sign in ((np.fmin, -1.0), (np.fmax, 1.0))
+           for xy in (paths.x, paths.y)]
+    near = ob.count_in_box(*box, window[:, None]) > 0
+    near = np.flatnonzero(np.any(near, axis=0))
+
+    # narrow phase: vectorized distance test over the candidates' points
+    hit, n_eval = ob.query_points(paths.x[near], paths.y[near],
+                                  time_index[None, :])
+    if profiler is not None:
+        profiler.count("collision_broad_phase_hits", len(near))
+        profiler.count("obstacle_distance_evals", n_eval)
+
+    collision = np.zeros(len(paths), dtype=bool)
+    collision[near] = np.any(hit.reshape(paths.x[near].shape), axis=1)
+
+    return ~collision
+
+
+def check_limits(lon, t_end, config=None):
+    """
+    Speed and accel limits of longitudinal polynomials over [0, t_end],
+    exact from their coefficients: the extrema lie at either end or at a
+    root of the next derivative, so no limit is broken between samples.
+    return a boolean array, True for polynomials within max_speed and
+    max_accel
+    """
+    if config is None:
+        config = PlannerConfig.from_globals()
+    _, v_max = lon.derivative(1).bounds(0.0, t_end)
+    a_min, a_max = lon.derivative(2).bounds(0.0, t_end)
+    return (v_max <= config.max_speed) & \
+        (np.maximum(-a_min, a_max) <= config.max_accel)
+
+
+@profiled("check_kinematics")
+def check_kinematics(paths, config=None):
+    """
+    return a boolean array, True for candidates within the speed, accel
+    and curvature limits. Speed and accel come from check_limits, the
+    curvature depends on the reference line and is checked at the samples.
+    """
+    if config is None:
+        config = PlannerConfig.from_globals()
+    ok = paths.limits_ok.astype(bool)  # Max speed and accel check
+    if profiler is not None:
+        profiler.count("check_paths_in", len(paths))
+        profiler.count("check_paths_limits_ok", np.sum(ok))
+    # Max curvature check, an undefined curvature on the course fails
+    ok &= ~np.any((np.abs(paths.c) > config.max_curvature) |
+                  (np.isnan(paths.c) & ~np.isnan(paths.x)), axis=1)
+    if profiler is not None:
+        profiler.count("check_paths_curvature_ok", np.sum(ok))
+
+    return ok
+
+
+def check_paths(paths, ob, config=None):
+    """
+    return a boolean array, True for candidates passing every check
+    """
+    if config is None:
+        config = PlannerConfig.from_globals()
+    if not isinstance(ob, ObstacleGrid):
+        ob = ObstacleGrid(ob, config.robot_radius)
+    ok = check_kinematics(paths, config)
+
+    ok_ind = np.flatnonzero(ok)
+    ok[ok_ind] = check_collision(paths.take(ok_ind), ob, config)
+    if profiler is not None:
+        profiler.count("check_paths_collision_ok", np.sum(ok))
+
+    return ok
+
+
+def find_best_path(paths, csp, ob, hint=None, config=None):
+    """
+    Best-first search over a lattice from calc_frenet_paths.
+    Candidates are visited in increasing cost, ties broken towards the
+    later candidate, and converted to global coordinates and checked in
+    batches of doubling size. The first feasible one is returned as an
+    index into `paths`, whose global fields are filled in for every
+    visited candidate, or None if no candidate is feasible.
+    hint: index of a likely winner (e.g. the last cycle's). If it is
+    feasible only the candidates ranked ahead of it are searched.
+    """
+    if config is None:
+        config = PlannerConfig.from_globals()
+    if not isinstance(ob, ObstacleGrid):
+        ob = ObstacleGrid(ob, config.robot_radius)
+    index = np.arange(len(paths))
+    fallback = None
+    if hint is not None and hint < len(paths):
+        sub = calc_global_paths(paths.take([hint]), csp)
+        paths.put([hint], sub)
+        if check_paths(sub, ob, config)[0]:
+            fallback = hint
+            cf = paths.cf[hint]
+            index = np.flatnonzero((paths.cf < cf) |
+                                   ((paths.cf == cf) & (index > hint)))
+    # candidates breaking the speed or accel limits are never converted
+    index = index[paths.limits_ok[index]]
+    order = index[np.lexsort((-index, paths.cf[index]))]
+
+    start, batch = 0, config.best_first_batch
+    while start < len(order):
+        index = order[start:start + batch]
+        sub = calc_global_paths(paths.take(index), csp)
+        paths.put(index, sub)
+        ok = np.flatnonzero(check_paths(sub, ob, config))
+        if len(ok) > 0:
+            return index[ok[0]]
+        start += batch
+        batch *= 2
+
+    return fallback
+
+
+@profiled_cycle
+def frenet_optimal_planning(csp, s0, c_speed, c_accel, c_d, c_d_d, c_d_dd, ob,
+                            best_first=True, evaluator=None, config=None,
+                            lattice=None):
+    """
+    evaluator: optional parallel_evaluation.ParallelEvaluator, every
+        candidate is then checked across its worker pool instead of
+        searching best-first, with the same result
+    config: PlannerConfig, the module parameters if None
+    lattice: FrenetLattice to sample, the grid of the config if None
+    """
+    if config is None:
+        config = PlannerConfig.from_globals()
+    paths = calc_frenet_paths(c_speed, c_accel, c_d, c_d_d, c_d_dd, s0,
+                              lattice=lattice, config=config)
+    if not isinstance(ob, ObstacleGrid):
+        ob = ObstacleGrid(ob, config.robot_radius)
+
+    if evaluator is not None:
+        _, best = evaluator.check_paths(paths, csp, ob, config)
+        if best is None:
+            return None
+        return paths.to_frenet_path(best)
+
+    if best_first:
+        best = find_best_path(paths, csp, ob, config=config)
+        if best is None:
+            return None
+        return paths.to_frenet_path(best)
+
+    paths = calc_global_paths(paths, csp)
+    ok = check_paths(paths, ob, config)
+
+    if not np.any(ok):
+        return None
+
+    # find minimum cost path, the last one wins a tie
+    cost = np.where(ok, paths.cf, np.inf)
+    best = len(cost) - 1 - np.argmin(cost[::-1])
+
+    return paths.to_frenet_path(best)
+
+
+class ReferenceWindow:
+    """
+    Slice of a CubicSpline2D covering the course positions [s_lo, s_hi]
+    with the same array evaluation API, so a planner can keep projecting
+    onto a short window of segments instead of the whole course.
+    Inside the window the results are identical to the full spline, and
+    s outside the course still gives NaN.
+    """
+
+    def __init__(self, csp, s_lo, s_hi):
+        knots = np.asarray(csp.s, dtype=float)
+        n_seg = len(knots) - 1
+        i0 = int(np.clip(np.searchsorted(knots, s_lo, side="right") - 1,
+                         0, n_seg - 1))
+        i1 = int(np.clip(np.searchsorted(knots, s_hi, side="left"),
+                         i0 + 1, n_seg))
+
+        # segment i1 is kept as well, so s == knots[i1] lands on the same
+        # segment as in the full spline
+        seg = slice(i0, min(i1, n_seg - 1) + 1)
+        self.knots = knots[seg]
+        self.s_lo = knots[i0]
+        self.s_hi = knots[i1]
+        self.course = (knots[0], knots[-1])
+        self.coef = [tuple(np.asarray(c)[seg]
+                           for c in (sp.a, sp.b, sp.c, sp.d))
+                     for sp in (csp.sx, csp.sy)]
+
+    def covers(self, s_lo, s_hi):
+        return self.s_lo <= s_lo and s_hi <= self.s_hi
+
+    def __search_index_array(self, s):
+        s = np.asarray(s, dtype=float)
+        inside = (s >= self.course[0]) & (s <= self.course[1])
+        i = np.searchsorted(self.knots, s, side="right") - 1
+        i = np.clip(i, 0, len(self.knots) - 1)
+        ds = np.where(inside, s - self.knots[i], 0.0)
+        return i, ds, inside
+
+    def calc_position_array(self, s):
+        i, ds, inside = self.__search_index_array(s)
+        xy = [a[i] + b[i] * ds + c[i] * ds ** 2.0 + d[i] * ds ** 3.0
+              for a, b, c, d in self.coef]
+        return tuple(np.where(inside, v, np.nan) for v in xy)
+
+    def calc_yaw_array(self, s):
+        i, ds, inside = self.__search_index_array(s)
+        dx, dy = [b[i] + 2.0 * c[i] * ds + 3.0 * d[i] * ds ** 2.0
+                  for _, b, c, d in self.coef]
+        return np.where(inside, np.arctan2(dy, dx), np.nan)
+
+    def calc_frame_array(self, s):
+        """
+        same as CubicSpline2D.calc_frame_array
+        """
+        i, ds, inside = self.__search_index_array(s)
+        (x, dx, ddx, dddx), (y, dy, ddy, dddy) = [
+            [np.where(inside, v, np.nan) for v in (
+                a[i] + (b[i] + (c[i] + d[i] * ds) * ds) * ds,
+                b[i] + (2.0 * c[i] + 3.0 * d[i] * ds) * ds,
+                2.0 * c[i] + 6.0 * d[i] * ds,
+                6.0 * d[i])]
+            for a, b, c, d in self.coef]
+        sigma = np.hypot(dx, dy)
+        sigma_d = (dx * ddx + dy * ddy) / sigma
+        cross = ddy * dx - ddx * dy
+        k = cross / sigma ** 3
+        dk = (dddy * dx - dddx * dy) / sigma ** 3 - \
+            3.0 * cross * sigma_d / sigma ** 4
+
+        return x, y, np.arctan2(dy, dx), sigma, sigma_d, k, dk
+
+
+class IncrementalPlanner:
+    """
+    Frenet optimal planner that keeps state between the cycles of one
+    vehicle: the reference-line window around the vehicle, the obstacle
+    index and the previous winner, which warm-starts the best-first
+    search. Returns the same path as frenet_optimal_planning.
+    config: PlannerConfig, the module parameters at construction if None
+    """
+
+    def __init__(self, csp, ob=None, config=None):
+        self.csp = csp
+        self.config = PlannerConfig.from_globals() if config is None \
+            else config
+        self.window = None
+        self.ob = None
+        self.ob_grid = None
+        self.last_best = None
+        self.last_s = None
+        if ob is not None:
+            self.set_obstacles(ob)
+
+    def set_obstacles(self, ob):
+        """
+        update the obstacle index, it is only rebuilt if `ob` changed
+        """
+        if isinstance(ob, ObstacleGrid):
+            self.ob, self.ob_grid = None, ob
+        elif self.ob is None or not np.array_equal(self.ob, ob):
+            self.ob = np.array(ob, dtype=float)
+            self.ob_grid = ObstacleGrid(self.ob, self.config.robot_radius)
+
+    def localize(self, x, y, yaw, v, a=0.0, kappa=0.0):
+        """
+        planner state of a vehicle pose, warm-started from the s of the
+        last planned cycle
+        return: s0, c_speed, c_accel, c_d, c_d_d, c_d_dd for plan
+        """
+        s, s_d, s_dd, d, d_p, d_pp = cartesian_to_frenet(
+            self.csp, x, y, yaw, v, a, kappa,
+            s_guess=np.nan if self.last_s is None else self.last_s)
+        return float(s), float(s_d), float(s_dd), float(d), \
+            float(d_p * s_d), float(d_pp * s_d ** 2 + d_p * s_dd)
+
+    @profiled_cycle
+    def plan(self, s0, c_speed, c_accel, c_d, c_d_d, c_d_dd, ob=None):
+        if ob is not None:
+            self.set_obstacles(ob)
+        self.last_s = s0
+        paths = calc_frenet_paths(c_speed, c_accel, c_d, c_d_d, c_d_dd, s0,
+                                  config=self.config)
+        if len(paths) == 0:
+            self.last_best = None
+            return None
+
+        if not isinstance(self.csp, cubic_spline_planner.CubicSpline2D):
+            # a ReferenceLine table has no segment search to shorten
+            self.window = self.csp
+        else:
+            s_lo = np.fmin.reduce(paths.s, axis=None)
+            s_hi = np.fmax.reduce(paths.s, axis=None)
+            if self.window is None or not self.window.covers(s_lo, s_hi):
+                self.window = ReferenceWindow(
+                    self.csp, s_lo,
+                    s_hi + self.config.reference_window_margin)
+
+        best = find_best_path(paths, self.window, self.ob_grid,
+                              hint=self.last_best, config=self.config)
+        self.last_best = best
+        if best is None:
+            return None
+
+        return paths.to_frenet_path(best)
+
+
+class FrenetPlanner:
+    """
+    Frenet optimal planner for one vehicle type: an immutable
+    PlannerConfig, the lattice built from it and an index per obstacle
+    set. plan keeps no per-call state on the planner, so one instance can
+    serve any number of threads at once, and planners with different
+    configs can run side by side in one process.
+    """
+
+    OBSTACLE_CACHE_SIZE = 8  # obstacle sets whose index is kept
+
+    def __init__(self, config=None):
+        self.config = PlannerConfig.from_globals() if config is None \
+            else config
+        self.lattice = self.config.lattice()
+        self._ob_grids = {}
+        self._ob_lock = threading.Lock()
+
+    def obstacle_grid(self, ob):
+        """
+        ObstacleGrid of the obstacles `ob`, built once per distinct array
+        """
+        if isinstance(ob, ObstacleGrid):
+            return ob
+        ob = np.asarray(ob, dtype=float)
+        key = (ob.shape, ob.tobytes())
+        with self._ob_lock:
+            grid = self._ob_grids.get(key)
+        if grid is None:
+            grid = ObstacleGrid(ob, self.config.robot_radius)
+            with self._ob_lock:
+                if len(self._ob_grids) >= self.OBSTACLE_CACHE_SIZE:
+                    self._ob_grids.pop(next(iter(self._ob_grids)))
+                self._ob_grids[key] = grid
+        return grid
+
+    def plan(self, csp, s0, c_speed, c_accel, c_d, c_d_d, c_d_dd, ob,
+             best_first=True):
+        """
+        one planning cycle, frenet_optimal_planning with this planner's
+        config
+        """
+        return frenet_optimal_planning(
+            csp, s0, c_speed, c_accel, c_d, c_d_d, c_d_dd,
+            self.obstacle_grid(ob), best_first, config=self.config,
+            lattice=self.lattice)
+
+
+def calc_frenet_projection(csp, x, y, s_guess=None):
+    """
+    Project Cartesian points onto the course, vectorized over points.
+    Points without a guess start from the nearest course sample every
+    PROJECTION_SAMPLE_DS, then Newton iterations on the foot point
+    condition (p - r(s)) . r'(s) = 0 refine s.
+    csp: CubicSpline2D or ReferenceLine
+    s_guess: optional s of every point to start from instead, e.g. the
+        last cycle's; NaN entries fall back to the nearest sample
+    return: s and signed lateral offset d (left of the course positive),
+        points beyond the ends project onto the end points
+    """
+    x, y = np.broadcast_arrays(np.asarray(x, dtype=float),
+                               np.asarray(y, dtype=float))
+    shape = x.shape
+    x, y = x.ravel(), y.ravel()
+    length = float(csp.s[-1])
+
+    s = np.full(len(x), np.nan)
+    if s_guess is not None:
+        s[:] = np.broadcast_to(np.asarray(s_guess, dtype=float), shape).ravel()
+    cold = np.flatnonzero(np.isnan(s))
+    if len(cold) > 0:
+        sample_s = np.append(np.arange(0.0, length, PROJECTION_SAMPLE_DS),
+                             length)
+        sample_x, sample_y = csp.calc_position_array(sample_s)
+        # nearest sample, in chunks to bound the distance matrix
+        for chunk in np.array_split(cold, -(-len(cold) // 1024)):
+            dist = (x[chunk, None] - sample_x) ** 2 + \
+                (y[chunk, None] - sample_y) ** 2
+            s[chunk] = sample_s[np.argmin(dist, axis=1)]
+    s = np.clip(s, 0.0, length)
+
+    active = np.arange(len(x))
+    for _ in range(PROJECTION_MAX_ITER):
+        rx, ry = csp.calc_position_array(s[active])
+        tx, ty = csp.calc_tangent_array(s[active])
+        ddx, ddy = csp.calc_tangent_rate_array(s[active])
+        dx, dy = x[active] - rx, y[active] - ry
+        norm2 = tx ** 2 + ty ** 2
+        k = (tx * ddy - ddx * ty) / norm2 ** 1.5
+        # f(s) = |p - r(s)|^2 / 2 has f' = -(p - r) . r' and, at the foot
+        # point, f'' = |r'|^2 (1 - k d). The curvature term is kept
+        # positive and the step bounded near the centre of curvature.
+        along = dx * tx + dy * ty
+        d = (dy * tx - dx * ty) / np.sqrt(norm2)
+        step = along / (norm2 * np.maximum(1.0 - k * d, 0.1))
+        step = np.clip(step, -PROJECTION_SAMPLE_DS, PROJECTION_SAMPLE_DS)
+        s_new = np.clip(s[active] + step, 0.0, length)
+        moving = np.abs(s_new - s[active]) > PROJECTION_TOL
+        s[active] = s_new
+        active = active[moving]
+        if len(active) == 0:
+            break
 
-    # find minimum cost path
-    min_cost = float("inf")
-    best_path = None
-    for fp in fplist:
-        if min_cost >= fp.cf:
-            min_cost = fp.cf
-            best_path = fp
+    rx, ry = csp.calc_position_array(s)
+    tx, ty = csp.calc_tangent_array(s)
+    d = ((y - ry) * tx - (x - rx) * ty) / np.hypot(tx, ty)
+
+    return s.reshape(shape), d.reshape(shape)
+
+
+def cartesian_to_frenet(csp, x, y, yaw, v, a=0.0, kappa=0.0, s_guess=None):
+    """
+    Frenet state of vehicles given in Cartesian coordinates, vectorized
+    over vehicles. It inverts calc_global_paths, where s is the course
+    parameter, which runs at |r'(s)| times the arc length.
+    x, y, yaw, v, a, kappa: position [m], heading [rad], speed [m/s],
+        acceleration along the heading [m/ss] and path curvature [1/m]
+    s_guess: optional warm start, see calc_frenet_projection
+    return: s, s_d, s_dd, d, d' and d'', where s_d and s_dd are time
+        derivatives and d', d'' derivatives with respect to s. The lateral
+        time derivatives of the planner state are d_d = d' s_d and
+        d_dd = d'' s_d^2 + d' s_dd.
+    """
+    s, d = calc_frenet_projection(csp, x, y, s_guess)
+    tx, ty = csp.calc_tangent_array(s)
+    ddx, ddy = csp.calc_tangent_rate_array(s)
+    r_k = csp.calc_curvature_array(s)
+    r_dk = csp.calc_curvature_rate_array(s)
+    sigma = np.hypot(tx, ty)
+    sigma_p = (tx * ddx + ty * ddy) / sigma
+
+    delta = np.asarray(yaw) - np.arctan2(ty, tx)
+    cos_delta = np.cos(delta)
+    tan_delta = np.tan(delta)
+
+    # the point moves along the course at A s_d and across it at d_d
+    A = sigma * (1.0 - r_k * d)
+    s_d = v * cos_delta / A
+    d_p = A * tan_delta
+    A_p = sigma_p * (1.0 - r_k * d) - sigma * (r_dk * d + r_k * d_p)
+    delta_p = kappa * A / cos_delta - sigma * r_k
+    d_pp = A_p * tan_delta + A * delta_p / cos_delta ** 2
+    s_dd = (a * cos_delta - A_p * s_d ** 2 -
+            A * s_d ** 2 * tan_delta * delta_p) / A
+
+    return s, s_d, s_dd, d, d_p, d_pp
+
+
+def generate_target_course(x, y, cache_dir=None):
+    """
+    cache_dir: if given, the course is a ReferenceLine lookup table,
+        loaded from this directory if the route was built before, in
+        place of the CubicSpline2D
+    """
+    if cache_dir is None:
+        csp = cubic_spline_planner.CubicSpline2D(x, y)
+    else:
+        csp = ReferenceLine.cached(x, y, cache_dir=cache_dir)
+    s = np.arange(0, csp.s[-1], 0.1)
 
-    return best_path
+    rx, ry = csp.calc_position_array(s)
+    ryaw = csp.calc_yaw_array(s)
+    rk = csp.calc_curvature_array(s)
+
+    return rx.tolist(), ry.tolist(), ryaw.tolist(), rk.tolist(), csp
+
+
+def simulate(wx, wy, ob, c_speed=10.0 / 3.6, c_accel=0.0, c_d=2.0,
+             c_d_d=0.0, c_d_dd=0.0, s0=0.0, sim_loop=SIM_LOOP,
+             cache_dir=None, config=None):
+    """
+    Closed-loop run of the planner along the course through the way
+    points `wx`, `wy` as a generator, yielding one record per cycle:
+        cycle: cycle number
+        status: "running", or "goal" / "no_path" on the last cycle
+        state: (s0, c_speed, c_accel, c_d, c_d_d, c_d_dd) planned from
+        path: the chosen FrenetPath, None if there was none
+        latency: planning time [s]
+    ob: (n, 2) static obstacle points, or (n, n_step, 2) obstacle
+        trajectories sampled every DT from the start of the simulation
+    cache_dir: reference line cache, see generate_target_course
+    config: PlannerConfig, the module parameters if None
+    Nothing is kept between cycles, so a run of any length streams in
+    constant memory.
+    """
+    tx, ty, tyaw, tc, csp = generate_target_course(wx, wy, cache_dir)
+    ob = np.asarray(ob, dtype=float)
+    moving = ob.ndim == 3
+    if not moving:
+        ob = ob.reshape(-1, 2)
+    planner = IncrementalPlanner(csp, ob, config)
+
+    for i in range(sim_loop):
+        state = (s0, c_speed, c_accel, c_d, c_d_d, c_d_dd)
+        start = time.perf_counter()
+        if moving:
+            planner.set_obstacles(ob[:, min(i, ob.shape[1] - 1):])
+        path = planner.plan(*state)
+        latency = time.perf_counter() - start
+
+        if path is None or len(path.x) < 2:
+            yield {"cycle": i, "status": "no_path", "state": state,
+                   "path": path, "latency": latency}
+            return
 
+        s0 = path.s[1]
+        c_d = path.d[1]
+        c_d_d = path.d_d[1]
+        c_d_dd = path.d_dd[1]
+        c_speed = path.s_d[1]
+        c_accel = path.s_dd[1]
 
-def generate_target_course(x, y):
-    csp = cubic_spline_planner.CubicSpline2D(x, y)
-    s = np.arange(0, csp.s[-1], 0.1)
+        goal = np.hypot(path.x[1] - tx[-1], path.y[1] - ty[-1]) <= 1.0
+        yield {"cycle": i, "status": "goal" if goal else "running",
+               "state": state, "path": path, "latency": latency}
+        if goal:
+            return
+
+
+def run_simulation(wx, wy, ob, c_speed=10.0 / 3.6, c_accel=0.0, c_d=2.0,
+                   c_d_d=0.0, c_d_dd=0.0, s0=0.0, sim_loop=SIM_LOOP,
+                   on_cycle=None, cache_dir=None, config=None, stop=None):
+    """
+    Headless closed-loop run of the planner, see simulate.
+    on_cycle: optional callable taking one record per cycle,
+        {"cycle", "x", "y", "speed"}, e.g. RenderProcess.submit
+    stop: optional Event ending the run, e.g. RenderProcess.stop
+    return: dict with the outcome ("goal", "no_path", "timeout" or
+        "stopped"), the number of cycles, per-cycle planning latency [s]
+        and path cost
+    """
+    status = "timeout"
+    latency, cost = [], []
+    state = (s0, c_speed, c_accel, c_d, c_d_d, c_d_dd)
+    for record in simulate(wx, wy, ob, c_speed, c_accel, c_d, c_d_d,
+                           c_d_dd, s0, sim_loop, cache_dir, config):
+        if stop is not None and stop.is_set():
+            status = "stopped"
+            break
+        latency.append(record["latency"])
+        path = record["path"]
+        if record["status"] == "no_path":
+            status = "no_path"
+            break
+        cost.append(path.cf)
+        state = (path.s[1], path.s_d[1], path.s_dd[1],
+                 path.d[1], path.d_d[1], path.d_dd[1])
 
-    rx, ry, ryaw, rk = [], [], [], []
-    for i_s in s:
-        ix, iy = csp.calc_position(i_s)
-        rx.append(ix)
-        ry.append(iy)
-        ryaw.append(csp.calc_yaw(i_s))
-        rk.append(csp.calc_curvature(i_s))
+        if on_cycle is not None:
+            on_cycle({"cycle": record["cycle"], "x": path.x, "y": path.y,
+                      "speed": path.s_d[1]})
+        if record["status"] == "goal":
+            status = "goal"
 
-    return rx, ry, ryaw, rk, csp
+    s0, c_speed, _, c_d, _, _ = state
+    return {"status": status, "cycles": len(latency), "latency": latency,
+            "cost": cost, "s": s0, "d": c_d, "speed": c_speed}
 
 
-def main():
+def main(gif=None, trace=None):
     print(__file__ + " Simulating Trajectory")
 
     # way points
@@ -258,56 +1243,41 @@ def main():
     # obstacle lists
     ob = np.array([[30.0, 8.0]])
 
-    tx, ty, tyaw, tc, csp = generate_target_course(wx, wy)
-
-    # initial state
-    c_speed = 10.0 / 3.6  # current speed [m/s]
-    c_accel = 0.0  # current acceleration [m/ss]
-    c_d = 2.0  # current lateral position [m]
-    c_d_d = 0.0  # current lateral speed [m/s]
-    c_d_dd = 0.0  # current lateral acceleration [m/s]
-    s0 = 0.0  # current course position
-
-    area = 20.0  # animation area length [m]
-
-    for i in range(SIM_LOOP):
-        path = frenet_optimal_planning(
-            csp, s0, c_speed, c_accel, c_d, c_d_d, c_d_dd, ob)
-
-        s0 = path.s[1]
-        c_d = path.d[1]
-        c_d_d = path.d_d[1]
-        c_d_dd = path.d_dd[1]
-        c_speed = path.s_d[1]
-        c_accel = path.s_dd[1]
-
-        if np.hypot(path.x[1] - tx[-1], path.y[1] - ty[-1]) <= 1.0:
-            print("Goal")
-            break
-
-        if show_animation:  # pragma: no cover
-            plt.cla()
-            # for stopping simulation with the esc key.
-            plt.gcf().canvas.mpl_connect(
-                'key_release_event',
-                lambda event: [exit(0) if event.key == 'escape' else None])
-            plt.plot(tx, ty)
-            plt.plot(wx, wy)
-            plt.plot(ob[:, 0], ob[:, 1], "xk")
-            plt.plot(path.x[1:], path.y[1:], "-or")
-            plt.plot(path.x[1], path.y[1], "vc")
-            plt.xlim(path.x[1] - area, path.x[1] + area)
-            plt.ylim(path.y[1] - area, path.y[1] + area)
-            plt.title("v[km/h]:" + str(c_speed * 3.6)[0:4])
-            plt.grid(True)
-            plt.pause(0.0001)
+    # planning and drawing are decoupled, the planner only hands one
+    # record per cycle to a renderer process or a trace file
+    sinks = []
+    stop = None
+    if trace is not None:
+        sinks.append(frenet_renderer.TraceWriter(trace, wx, wy, ob))
+    if show_animation or gif is not None:  # pragma: no cover
+        render = frenet_renderer.RenderProcess(wx, wy, ob, output=gif)
+        sinks.append(render)
+        # for stopping simulation with the esc key.
+        stop = render.stop
+
+    def on_cycle(record):
+        for sink in sinks:
+            sink.submit(record)
+
+    result = run_simulation(wx, wy, ob, on_cycle=on_cycle, stop=stop)
+    if result["status"] == "goal":
+        print("Goal")
 
     print("Finish")
-    if show_animation:  # pragma: no cover
-        plt.grid(True)
-        plt.pause(0.0001)
-        plt.show()
+    for sink in sinks:
+        sink.close()
 
 
 if __name__ == '__main__':
-    main()
\ No newline at end of file
+    import argparse
+    parser = argparse.ArgumentParser(
+        description="Frenet optimal trajectory simulation")
+    parser.add_argument("--gif", help="render into this GIF file")
+    parser.add_argument("--trace", help="write a trace file for "
+                                        "frenet_renderer.py")
+    parser.add_argument("--headless", action="store_true",
+                        help="no live animation")
+    args = parser.parse_args()
+    if args.headless:
+        show_animation = False
+    main(gif=args.gif, trace=args.trace)
@@ -0,0 +1,214 @@
+"""
+Renderer for Frenet optimal trajectory simulations, decoupled from the
+planner loop
+
+The planner loop only emits one small record per cycle
+({"cycle", "x", "y", "speed"}), either into a RenderProcess, which
+draws live or writes a GIF from a background process, or into a trace
+file (JSON lines) that is rendered offline:
+
+    python frenet_optimal_trajectory.py --trace run.jsonl --headless
+    python frenet_renderer.py run.jsonl -o run.gif
+"""
+
+import argparse
+import json
+import multiprocessing
+import pathlib
+import queue
+import sys
+
+import numpy as np
+
+sys.path.append(str(pathlib.Path(__file__).parent))
+
+import cubic_spline_planner
+
+RENDER_QUEUE_SIZE = 64  # cycles buffered for the render process
+RENDER_PUT_TIMEOUT = 0.1  # check the renderer is alive this often [s]
+RENDER_CLOSE_TIMEOUT = 5.0  # wait for a renderer that stopped reading [s]
+AREA = 20.0  # animation area length [m]
+
+
+def render_cycles(header, records, output=None, area=AREA, fps=10,
+                  stop=None):
+    """
+    draw the course from `header` ({"wx", "wy", "ob"}) and one frame per
+    cycle record, until the records end or the esc key is pressed
+    output: None to show the frames in a window, a .gif file name, or a
+        directory to write one PNG per frame into
+    stop: optional Event set on the esc key, e.g. to stop the planner
+    """
+    import matplotlib
+    if output is not None:
+        matplotlib.use("Agg")
+    import matplotlib.animation
+    import matplotlib.pyplot as plt
+
+    wx, wy = header["wx"], header["wy"]
+    ob = np.asarray(header["ob"], dtype=float)
+    if ob.ndim != 3:
+        # static points are a trajectory of one step
+        ob = ob.reshape(-1, 1, 2)
+    tx, ty, _, _, _ = cubic_spline_planner.calc_spline_course(wx, wy, 0.1)
+
+    fig, ax = plt.subplots()
+    escaped = multiprocessing.Event() if stop is None else stop
+
+    def on_key(event):
+        # for stopping simulation with the esc key.
+        if event.key == 'escape':
+            escaped.set()
+
+    fig.canvas.mpl_connect('key_release_event', on_key)
+    ax.plot(tx, ty)
+    ax.plot(wx, wy)
+    ob_points, = ax.plot(ob[:, 0, 0], ob[:, 0, 1], "xk")
+    path_line, = ax.plot([], [], "-or")
+    vehicle, = ax.plot([], [], "vc")
+    ax.grid(True)
+
+    writer = None
+    frame_dir = None
+    if output is not None and str(output).endswith(".gif"):
+        writer = matplotlib.animation.PillowWriter(fps=fps)
+        writer.setup(fig, str(output))
+    elif output is not None:
+        frame_dir = pathlib.Path(output)
+        frame_dir.mkdir(parents=True, exist_ok=True)
+
+    for record in records:
+        if escaped.is_set():
+            break
+        x, y = record["x"], record["y"]
+        step = min(record["cycle"], ob.shape[1] - 1)
+        ob_points.set_data(ob[:, step, 0], ob[:, step, 1])
+        path_line.set_data(x[1:], y[1:])
+        vehicle.set_data([x[1]], [y[1]])
+        ax.set_xlim(x[1] - area, x[1] + area)
+        ax.set_ylim(y[1] - area, y[1] + area)
+        ax.set_title("v[km/h]:" + str(record["speed"] * 3.6)[0:4])
+        if writer is not None:
+            writer.grab_frame()
+        elif frame_dir is not None:
+            fig.savefig(frame_dir / ("frame_%05d.png" % record["cycle"]))
+        else:
+            plt.pause(0.0001)
+
+    if writer is not None:
+        writer.finish()
+    if output is None and not escaped.is_set():
+        plt.show()
+    plt.close(fig)
+
+
+def _render_queue(header, q, output, area, stop):
+    render_cycles(header, iter(q.get, None), output, area, stop=stop)
+
+
+class RenderProcess:
+    """
+    render cycle records in a background process fed through a bounded
+    queue. Drawing live, a full queue drops the frame instead of blocking
+    the planner. Writing a file, every frame is kept. The esc key in the
+    window sets the `stop` Event for the planner loop to check.
+    """
+
+    def __init__(self, wx, wy, ob, output=None, area=AREA):
+        header = {"wx": list(wx), "wy": list(wy),
+                  "ob": np.asarray(ob, dtype=float).tolist()}
+        self.drop_frames = output is None
+        self.dropped = 0
+        self.stop = multiprocessing.Event()
+        self.queue = multiprocessing.Queue(maxsize=RENDER_QUEUE_SIZE)
+        self.process = multiprocessing.Process(
+            target=_render_queue,
+            args=(header, self.queue, output, area, self.stop), daemon=True)
+        self.process.start()
+
+    def submit(self, record):
+        if self.drop_frames:
+            try:
+                self.queue.put_nowait(record)
+            except queue.Full:
+                self.dropped += 1
+        elif not self._put(record):
+            self.dropped += 1
+
+    def close(self, timeout=RENDER_CLOSE_TIMEOUT):
+        """
+        wait until the renderer has drawn everything, or the window closed,
+        at most `timeout` [s] once the renderer has stopped reading
+        """
+        if self._put(None):
+            self.process.join()
+        else:
+            self.process.join(timeout)
+        if self.process.is_alive():
+            self.process.terminate()
+        # records left in a queue nobody reads must not block our exit
+        self.queue.cancel_join_thread()
+
+    def _put(self, item):
+        """
+        put `item` while the renderer runs
+        return: whether it was queued
+        """
+        while self.process.is_alive() and not self.stop.is_set():
+            try:
+                self.queue.put(item, timeout=RENDER_PUT_TIMEOUT)
+                return True
+            except queue.Full:
+                pass
+        return False
+
+
+class TraceWriter:
+    """
+    write cycle records to a JSON lines trace file for offline rendering
+    """
+
+    def __init__(self, path, wx, wy, ob):
+        self.file = open(path, "w")
+        self.file.write(json.dumps(
+            {"wx": list(wx), "wy": list(wy),
+             "ob": np.asarray(ob, dtype=float).tolist()}) + "\n")
+
+    def submit(self, record):
+        self.file.write(json.dumps(record) + "\n")
+
+    def close(self):
+        self.file.close()
+
+
+def read_trace(path):
+    """
+    return: trace header and an iterator over its cycle records
+    """
+    f = open(path)
+    header = json.loads(f.readline())
+
+    def records():
+        with f:
+            for line in f:
+                yield json.loads(line)
+
+    return header, records()
+
+
+def main():
+    parser = argparse.ArgumentParser(
+        description="render a Frenet simulation trace file")
+    parser.add_argument("trace", help="JSON lines trace file")
+    parser.add_argument("-o", "--output",
+                        help=".gif file or frame directory, a window if "
+                             "omitted")
+    parser.add_argument("--area", type=float, default=AREA)
+    args = parser.parse_args()
+
+    header, records = read_trace(args.trace)
+    render_cycles(header, records, args.output, args.area)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,122 @@
+"""
+Per-stage timing and counters for the Frenet optimal trajectory planner
+
+Recording is opt-in: assign a PlannerProfiler to
+frenet_optimal_trajectory.profiler. While it is None (the default) every
+instrumentation point in the planner is a single `is None` test.
+
+>>> import frenet_optimal_trajectory as fot
+>>> from instrumentation import PlannerProfiler
+>>> fot.profiler = PlannerProfiler()
+>>> # ... run the planner ...
+>>> fot.profiler.write_jsonl("cycles.jsonl")
+>>> fot.profiler.write_chrome_trace("trace.json")  # chrome://tracing
+
+Each planning cycle becomes one record with the wall time of every stage
+(calc_frenet_paths, calc_global_paths, check_kinematics,
+check_collision) and counters, e.g. the candidates surviving each filter
+of check_paths and the obstacle distance evaluations.
+"""
+
+import contextlib
+import json
+import os
+import threading
+import time
+
+
+class PlannerProfiler:
+
+    def __init__(self):
+        self.cycles = []  # finished cycle records
+        self.events = []  # chrome trace events
+        self._local = threading.local()
+        self._lock = threading.Lock()
+        self._t0 = time.perf_counter_ns()
+
+    def _now_us(self):
+        return (time.perf_counter_ns() - self._t0) / 1e3
+
+    def _current(self):
+        return getattr(self._local, "cycle", None)
+
+    @contextlib.contextmanager
+    def cycle(self, **info):
+        """
+        one planning cycle, stages and counters inside it are attached
+        to its record. Nested cycles are folded into the outer one.
+        """
+        if self._current() is not None:
+            yield
+            return
+
+        record = {"cycle": None, "thread": threading.get_ident(),
+                  "start_us": self._now_us(), "stages": {}, "counters": {}}
+        record.update(info)
+        self._local.cycle = record
+        try:
+            yield
+        finally:
+            self._local.cycle = None
+            record["duration_us"] = self._now_us() - record["start_us"]
+            with self._lock:
+                record["cycle"] = len(self.cycles)
+                self.cycles.append(record)
+                self.events.append(self._event("cycle", record["start_us"],
+                                               record["duration_us"]))
+                self.events.append({
+                    "name": "counters", "ph": "C", "pid": os.getpid(),
+                    "ts": record["start_us"] + record["duration_us"],
+                    "args": record["counters"]})
+
+    @contextlib.contextmanager
+    def stage(self, name):
+        """
+        one stage of the current cycle, repeated stages add up
+        """
+        start = self._now_us()
+        try:
+            yield
+        finally:
+            duration = self._now_us() - start
+            record = self._current()
+            if record is not None:
+                stages = record["stages"]
+                stages[name] = stages.get(name, 0.0) + duration
+            with self._lock:
+                self.events.append(self._event(name, start, duration))
+
+    def count(self, name, n=1):
+        """
+        add `n` to a counter of the current cycle
+        """
+        record = self._current()
+        if record is not None:
+            counters = record["counters"]
+            counters[name] = counters.get(name, 0) + int(n)
+
+    def _event(self, name, start, duration):
+        return {"name": name, "ph": "X", "ts": start, "dur": duration,
+                "pid": os.getpid(), "tid": threading.get_ident()}
+
+    def reset(self):
+        with self._lock:
+            self.cycles = []
+            self.events = []
+
+    def write_jsonl(self, path):
+        """
+        one JSON line per cycle, stage times in microseconds
+        """
+        with open(path, "w") as f:
+            for record in self.cycles:
+                f.write(json.dumps(record) + "\n")
+
+    def write_chrome_trace(self, path):
+        """
+        the whole run in the Chrome trace event format, for
+        chrome://tracing or https://ui.perfetto.dev
+        """
+        with open(path, "w") as f:
+            json.dump({"traceEvents": self.events,
+                       "displayTimeUnit": "ms"}, f)
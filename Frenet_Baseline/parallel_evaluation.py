@@ -0,0 +1,196 @@
+"""
+Parallel candidate evaluation for large Frenet lattices
+
+With a wide road, a fine D_ROAD_W and several target speeds the lattice
+of calc_frenet_paths reaches tens of thousands of candidates, and
+calc_global_paths plus check_paths dominate a cycle. ParallelEvaluator
+shards the candidates across a process pool. The candidate arrays live
+in one shared memory block that every worker maps, so no path data is
+pickled: a task is only a row range plus the course, the obstacle index
+and the limits. Each worker converts and checks its rows in place and
+returns its cheapest feasible candidate, and the shard minima are reduced
+to the global one with the tie-break of the serial search, so the chosen
+path is exactly the one of frenet_optimal_planning.
+
+>>> with ParallelEvaluator(processes=4) as evaluator:
+...     path = fot.frenet_optimal_planning(csp, s0, c_speed, c_accel,
+...                                        c_d, c_d_d, c_d_dd, ob,
+...                                        evaluator=evaluator)
+"""
+
+import multiprocessing
+import pathlib
+import sys
+from multiprocessing import resource_tracker, shared_memory
+
+import numpy as np
+
+sys.path.append(str(pathlib.Path(__file__).parent))
+
+import frenet_optimal_trajectory as fot
+
+# lattices smaller than this are evaluated in the calling process
+PARALLEL_MIN_CANDIDATES = 2000
+
+# per-candidate fields of the shared block, after the per-point ones
+ROW_FIELDS = ("n_point", "n_global") + fot.FrenetCandidates.ROW_FIELDS + \
+    ("ok",)
+POINT_FIELDS = fot.FrenetCandidates.FRENET_FIELDS + \
+    fot.FrenetCandidates.GLOBAL_FIELDS
+
+
+def _layout(n_cand, n_t):
+    """
+    offsets and shapes of the float64 arrays in a shared block
+    """
+    layout, offset = {}, 0
+    for name in POINT_FIELDS:
+        layout[name] = (offset, (n_cand, n_t))
+        offset += n_cand * n_t
+    for name in ROW_FIELDS:
+        layout[name] = (offset, (n_cand,))
+        offset += n_cand
+    return layout, offset
+
+
+def _views(buf, n_cand, n_t):
+    layout, _ = _layout(n_cand, n_t)
+    return {name: np.ndarray(shape, dtype=np.float64, buffer=buf,
+                             offset=offset * 8)
+            for name, (offset, shape) in layout.items()}
+
+
+# shared blocks mapped by this worker process, by name
+_attached = {}
+
+
+def _attach(name):
+    if name not in _attached:
+        for block in _attached.values():
+            block.close()
+        _attached.clear()
+        _attached[name] = shared_memory.SharedMemory(name=name)
+    return _attached[name]
+
+
+def _evaluate_shard(task):
+    """
+    worker: convert and check rows [lo, hi) of the shared lattice
+    return: index and cost of the shard's cheapest feasible candidate,
+        (None, inf) if there is none
+    """
+    name, n_cand, t, lo, hi, csp, ob, config = task
+    view = _views(_attach(name).buf, n_cand, len(t))
+
+    paths = fot.FrenetCandidates(
+        t, view["n_point"][lo:hi].astype(np.int64),
+        **{name: view[name][lo:hi] for name in
+           fot.FrenetCandidates.FRENET_FIELDS +
+           fot.FrenetCandidates.ROW_FIELDS})
+    paths = fot.calc_global_paths(paths, csp)
+    ok = fot.check_paths(paths, ob, config)
+
+    for name in fot.FrenetCandidates.GLOBAL_FIELDS:
+        view[name][lo:hi] = getattr(paths, name)
+    view["n_global"][lo:hi] = paths.n_global
+    view["ok"][lo:hi] = ok
+
+    return _reduce_best(ok, paths.cf, lo)
+
+
+def _reduce_best(ok, cf, offset=0):
+    """
+    cheapest feasible candidate, the last one wins a tie
+    """
+    if not np.any(ok):
+        return None, np.inf
+    cost = np.where(ok, cf, np.inf)
+    best = len(cost) - 1 - int(np.argmin(cost[::-1]))
+    return offset + best, float(cost[best])
+
+
+class ParallelEvaluator:
+    """
+    Process pool converting and checking lattice candidates in shards.
+    processes: number of worker processes, all cores if None
+    min_candidates: smaller lattices are evaluated in this process
+    """
+
+    def __init__(self, processes=None,
+                 min_candidates=PARALLEL_MIN_CANDIDATES):
+        self.processes = processes or multiprocessing.cpu_count()
+        self.min_candidates = min_candidates
+        # workers must share this process' resource tracker, one of their
+        # own would unlink the shared block when the worker exits
+        resource_tracker.ensure_running()
+        self.pool = multiprocessing.Pool(self.processes)
+        self.block = None
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+    def close(self):
+        self.pool.close()
+        self.pool.join()
+        if self.block is not None:
+            self.block.close()
+            self.block.unlink()
+            self.block = None
+
+    def _shared_views(self, n_cand, n_t):
+        """
+        views into the shared block, grown when the lattice outgrows it
+        """
+        _, size = _layout(n_cand, n_t)
+        if self.block is None or self.block.size < size * 8:
+            if self.block is not None:
+                self.block.close()
+                self.block.unlink()
+            self.block = shared_memory.SharedMemory(create=True,
+                                                    size=size * 8)
+        return _views(self.block.buf, n_cand, n_t)
+
+    def check_paths(self, paths, csp, ob, config=None):
+        """
+        calc_global_paths and check_paths over every candidate of
+        `paths`, whose global fields are filled in
+        config: PlannerConfig sent to the workers with every task, the
+            caller's module parameters if None
+        return: boolean array of feasible candidates, and the index of the
+            cheapest feasible one (the last one on a tie) or None
+        """
+        if config is None:
+            config = fot.PlannerConfig.from_globals()
+        if not isinstance(ob, fot.ObstacleGrid):
+            ob = fot.ObstacleGrid(ob, config.robot_radius)
+        n_cand, n_t = len(paths), len(paths.t)
+        if n_cand < self.min_candidates or self.processes == 1:
+            fot.calc_global_paths(paths, csp)
+            ok = fot.check_paths(paths, ob, config)
+            return ok, _reduce_best(ok, paths.cf)[0]
+
+        view = self._shared_views(n_cand, n_t)
+        for name in fot.FrenetCandidates.FRENET_FIELDS + \
+                fot.FrenetCandidates.ROW_FIELDS:
+            view[name][:] = getattr(paths, name)
+        view["n_point"][:] = paths.n_point
+
+        bounds = np.linspace(0, n_cand, self.processes + 1).astype(int)
+        tasks = [(self.block.name, n_cand, paths.t, lo, hi, csp, ob, config)
+                 for lo, hi in zip(bounds[:-1], bounds[1:]) if hi > lo]
+        shard_best = self.pool.map(_evaluate_shard, tasks)
+
+        for name in fot.FrenetCandidates.GLOBAL_FIELDS:
+            setattr(paths, name, view[name].copy())
+        paths.n_global = view["n_global"].astype(np.int64)
+        ok = view["ok"].astype(bool)
+
+        # shards are in index order, so a later shard wins a tie
+        best, best_cost = None, np.inf
+        for index, cost in shard_best:
+            if index is not None and cost <= best_cost:
+                best, best_cost = index, cost
+        return ok, best
@@ -0,0 +1,412 @@
+"""
+Local Frenet planning service with cross-vehicle micro-batching
+
+Every frenet_optimal_planning call pays the Python overhead of building
+and searching a lattice. PlanningService is an asyncio service that
+queues the requests of many vehicles. It waits a short window after the
+first one, then plans the whole batch at once with FleetPlanner
+(independent agents, one calc_frenet_paths call and one batched
+best-first search), so the overhead is paid per batch, not per call.
+Planning runs in a worker thread, and the next batch queues up in the
+meantime.
+
+The vehicles share the service's courses and static obstacles and pick
+a course per request. The service is used in-process, or over a Unix
+socket with newline-delimited JSON through PlanningClient:
+
+>>> async with PlanningService(csp, ob) as service:
+...     result = await service.plan(s0, c_speed, c_accel, c_d, c_d_d,
+...                                 c_d_dd)
+...     result["path"], result["latency"], result["batch"]
+
+usage:
+    python planning_service.py --vehicles 200 --ticks 20
+    python planning_service.py --vehicles 200 --unix /tmp/planner.sock
+    python planning_service.py --serve /tmp/planner.sock
+"""
+
+import argparse
+import asyncio
+import collections
+import concurrent.futures
+import itertools
+import json
+import operator
+import pathlib
+import sys
+import time
+
+import numpy as np
+
+sys.path.append(str(pathlib.Path(__file__).parent))
+
+import frenet_optimal_trajectory as fot
+from fleet_planner import FleetPlanner, STATE_FIELDS, make_fleet
+
+SERVICE_WINDOW = 0.002  # wait for more requests after the first [s]
+SERVICE_MAX_BATCH = 512  # requests planned together at most
+SERVICE_STATS_SIZE = 10000  # recent requests kept for latency stats
+STREAM_LIMIT = 2 ** 22  # longest JSON line on the socket [byte]
+
+# FrenetPath fields sent over the socket
+PATH_FIELDS = ("t", "d", "d_d", "d_dd", "s", "s_d", "s_dd", "x", "y",
+               "yaw", "v", "c")
+
+
+class PlanningService:
+    """
+    asyncio planning service batching concurrent requests
+    courses, ob, config: as for FleetPlanner
+    window: time to collect requests after the first of a batch [s]
+    max_batch: largest batch, a full queue is planned without waiting
+    """
+
+    def __init__(self, courses, ob=None, config=None, window=SERVICE_WINDOW,
+                 max_batch=SERVICE_MAX_BATCH):
+        self.planner = FleetPlanner(courses, ob, config)
+        self.window = window
+        self.max_batch = max_batch
+        self.queue = None
+        self.task = None
+        self.batch = []  # requests being collected or planned
+        self.closed = False
+        # one batch at a time, FleetPlanner is not shared across threads
+        self.executor = concurrent.futures.ThreadPoolExecutor(1)
+        self.n_request = 0
+        self.n_batch = 0
+        self.latency = collections.deque(maxlen=SERVICE_STATS_SIZE)
+
+    async def __aenter__(self):
+        await self.start()
+        return self
+
+    async def __aexit__(self, *exc):
+        await self.close()
+
+    async def start(self):
+        self.queue = asyncio.Queue()
+        self.task = asyncio.get_running_loop().create_task(self._serve())
+
+    async def close(self):
+        """
+        stop serving, pending requests fail with a RuntimeError
+        """
+        self.closed = True
+        if self.task is not None:
+            self.task.cancel()
+            try:
+                await self.task
+            except asyncio.CancelledError:
+                pass
+        pending = self.batch
+        while self.queue is not None and not self.queue.empty():
+            pending.append(self.queue.get_nowait())
+        for *_, future in pending:
+            if not future.done():
+                future.set_exception(RuntimeError("planning service closed"))
+        self.batch = []
+        self.executor.shutdown()
+
+    async def plan(self, s0, c_speed, c_accel, c_d, c_d_d, c_d_dd, course=0):
+        """
+        plan one cycle of one vehicle
+        return: dict with the FrenetPath or None ("path"), the time from
+            the request to the result ("latency") and in the queue
+            ("queue") [s], and the size of its batch ("batch")
+        """
+        if self.closed:
+            raise RuntimeError("planning service closed")
+        if self.queue is None:
+            raise RuntimeError("planning service not started")
+        # bad requests fail here, not the whole batch they would join
+        state = tuple(map(float, (s0, c_speed, c_accel, c_d, c_d_d, c_d_dd)))
+        course = operator.index(course)
+        if not 0 <= course < len(self.planner.courses):
+            raise ValueError("no course %d, the service has %d" % (
+                course, len(self.planner.courses)))
+        future = asyncio.get_running_loop().create_future()
+        self.queue.put_nowait((state, course, time.perf_counter(), future))
+        return await future
+
+    def stats(self):
+        """
+        request and batch counts and the latency of the recent requests
+        """
+        latency = np.array(self.latency)
+        return {"requests": self.n_request, "batches": self.n_batch,
+                "mean_batch": self.n_request / max(self.n_batch, 1),
+                "latency_median": float(np.median(latency))
+                if len(latency) else None,
+                "latency_p99": float(np.percentile(latency, 99))
+                if len(latency) else None,
+                "latency_max": float(np.max(latency, initial=0.0))}
+
+    async def _serve(self):
+        loop = asyncio.get_running_loop()
+        while True:
+            self.batch = batch = [await self.queue.get()]
+            if self.queue.qsize() < self.max_batch - 1:
+                await asyncio.sleep(self.window)
+            while len(batch) < self.max_batch and not self.queue.empty():
+                batch.append(self.queue.get_nowait())
+
+            start = time.perf_counter()
+            try:
+                paths = await loop.run_in_executor(self.executor,
+                                                   self._plan_batch, batch)
+            except Exception as e:
+                for *_, future in batch:
+                    if not future.done():
+                        future.set_exception(e)
+                self.batch = []
+                continue
+            self.batch = []
+            done = time.perf_counter()
+
+            self.n_batch += 1
+            self.n_request += len(batch)
+            for (_, _, queued, future), path in zip(batch, paths):
+                self.latency.append(done - queued)
+                if not future.done():
+                    future.set_result({"path": path, "latency": done - queued,
+                                       "queue": start - queued,
+                                       "batch": len(batch)})
+
+    def _plan_batch(self, batch):
+        state = np.array([request[0] for request in batch], dtype=float)
+        course = np.array([request[1] for request in batch])
+        return self.planner.plan(*state.T, course=course, independent=True)
+
+
+def encode_result(request_id, result):
+    """
+    JSON line of a PlanningService result
+    """
+    path = result["path"]
+    message = {"id": request_id, "status": "no_path" if path is None
+               else "ok", "latency": result["latency"],
+               "queue": result["queue"], "batch": result["batch"],
+               "path": None}
+    if path is not None:
+        message["path"] = {name: getattr(path, name) for name in PATH_FIELDS}
+        message["path"]["cf"] = path.cf
+    return (json.dumps(message) + "\n").encode()
+
+
+async def serve_unix(service, path):
+    """
+    serve `service` on a Unix socket. A request is one JSON line
+    {"id", "state": [s0, c_speed, c_accel, c_d, c_d_d, c_d_dd], "course"},
+    answered by a line with the same id, in completion order, so one
+    connection can carry many requests at once.
+    return: the asyncio Server
+    """
+    async def answer(line, writer):
+        # a bad line is answered with an error, the connection stays open
+        request_id = None
+        try:
+            request = json.loads(line)
+            request_id = request.get("id")
+            result = await service.plan(*request["state"],
+                                        course=request.get("course", 0))
+            writer.write(encode_result(request_id, result))
+        except Exception as e:
+            writer.write((json.dumps({"id": request_id, "status": "error",
+                                      "error": repr(e)}) + "\n").encode())
+
+    async def handle(reader, writer):
+        pending = set()
+        async for line in reader:
+            task = asyncio.get_running_loop().create_task(
+                answer(line, writer))
+            pending.add(task)
+            task.add_done_callback(pending.discard)
+        await asyncio.gather(*pending)
+        writer.close()
+
+    return await asyncio.start_unix_server(handle, path, limit=STREAM_LIMIT)
+
+
+class PlanningClient:
+    """
+    client of a planning service on a Unix socket, requests from any
+    number of tasks share the connection
+    """
+
+    def __init__(self, path):
+        self.path = path
+        self.reader = None
+        self.writer = None
+        self.pending = {}
+        self.ids = itertools.count()
+        self.task = None
+
+    async def __aenter__(self):
+        await self.connect()
+        return self
+
+    async def __aexit__(self, *exc):
+        await self.close()
+
+    async def connect(self):
+        self.reader, self.writer = await asyncio.open_unix_connection(
+            self.path, limit=STREAM_LIMIT)
+        self.task = asyncio.get_running_loop().create_task(self._read())
+
+    async def close(self):
+        if self.writer is not None:
+            self.writer.close()
+        if self.task is not None:
+            await self.task
+
+    async def plan(self, s0, c_speed, c_accel, c_d, c_d_d, c_d_dd, course=0):
+        """
+        return: the service's answer, the path as a dict of lists or None
+        """
+        request_id = next(self.ids)
+        future = asyncio.get_running_loop().create_future()
+        self.pending[request_id] = future
+        self.writer.write((json.dumps({
+            "id": request_id, "course": int(course),
+            "state": [float(v) for v in (s0, c_speed, c_accel, c_d, c_d_d,
+                                         c_d_dd)]}) + "\n").encode())
+        return await future
+
+    async def _read(self):
+        async for line in self.reader:
+            message = json.loads(line)
+            future = self.pending.pop(message["id"], None)
+            if future is None:
+                continue
+            if message["status"] == "error":
+                future.set_exception(RuntimeError(message["error"]))
+            else:
+                future.set_result(message)
+        for future in self.pending.values():
+            future.set_exception(ConnectionError("planning service closed"))
+
+
+def next_state(path, state):
+    """
+    the state one step along a planned path, a FrenetPath or the dict of
+    a PlanningClient answer, `state` unchanged without a path
+    """
+    if path is None:
+        return state
+    get = path.__getitem__ if isinstance(path, dict) else \
+        lambda name: getattr(path, name)
+    return tuple(get(name)[1] for name in
+                 ("s", "s_d", "s_dd", "d", "d_d", "d_dd"))
+
+
+async def run_load(plan, states, n_ticks):
+    """
+    load generator: every tick, all vehicles request a plan at once
+    through the coroutine function `plan` and advance along their paths
+    states: dict of per-vehicle arrays for the keys of STATE_FIELDS
+    return: the time of every tick [s] and the latency of every request
+    """
+    vehicles = [tuple(float(states[key][i]) for key in STATE_FIELDS)
+                for i in range(len(states["s0"]))]
+    tick_time, latency = [], []
+    for _ in range(n_ticks):
+        start = time.perf_counter()
+        results = await asyncio.gather(*[plan(*state) for state in vehicles])
+        tick_time.append(time.perf_counter() - start)
+        latency += [result["latency"] for result in results]
+        vehicles = [next_state(result["path"], state)
+                    for result, state in zip(results, vehicles)]
+    return tick_time, latency
+
+
+def run_serial(csp, ob, states, n_ticks, config=None):
+    """
+    the same load with one frenet_optimal_planning call per request
+    """
+    vehicles = [tuple(float(states[key][i]) for key in STATE_FIELDS)
+                for i in range(len(states["s0"]))]
+    ob_grid = fot.ObstacleGrid(ob, fot.ROBOT_RADIUS if config is None
+                               else config.robot_radius)
+    tick_time, latency = [], []
+    for _ in range(n_ticks):
+        start = time.perf_counter()
+        paths = []
+        for state in vehicles:
+            call = time.perf_counter()
+            paths.append(fot.frenet_optimal_planning(csp, *state, ob_grid,
+                                                     config=config))
+            latency.append(time.perf_counter() - call)
+        tick_time.append(time.perf_counter() - start)
+        vehicles = [next_state(path, state)
+                    for path, state in zip(paths, vehicles)]
+    return tick_time, latency
+
+
+def make_world(length=1000.0):
+    """
+    the benchmark course and obstacles
+    """
+    wx = np.linspace(0.0, length, 11)
+    wy = 10.0 * np.sin(wx / length * 4.0 * np.pi)
+    _, _, _, _, csp = fot.generate_target_course(wx, wy)
+    ob = np.column_stack([np.linspace(50.0, length - 50.0, 20),
+                          np.tile([5.0, -5.0], 10)])
+    return csp, ob
+
+
+async def benchmark(n_vehicles, n_ticks, socket_path=None,
+                    window=SERVICE_WINDOW):
+    csp, ob = make_world()
+    states = make_fleet(n_vehicles, 1000.0)
+    rows = [("serial calls", *run_serial(csp, ob, states, n_ticks))]
+
+    async with PlanningService(csp, ob, window=window) as service:
+        rows.append(("in-process service",
+                     *await run_load(service.plan, states, n_ticks)))
+        stats = service.stats()
+        if socket_path is not None:
+            server = await serve_unix(service, socket_path)
+            async with PlanningClient(socket_path) as client:
+                rows.append(("unix socket service",
+                             *await run_load(client.plan, states, n_ticks)))
+            server.close()
+            await server.wait_closed()
+
+    print("%d vehicles, %d ticks, mean batch %.1f" % (
+        n_vehicles, n_ticks, stats["mean_batch"]))
+    for name, tick_time, latency in rows:
+        print("  %-20s %8.0f plans/s  tick median %7.1f ms  "
+              "latency median %6.1f ms p99 %6.1f ms" % (
+                  name, n_vehicles * n_ticks / np.sum(tick_time),
+                  np.median(tick_time) * 1e3, np.median(latency) * 1e3,
+                  np.percentile(latency, 99) * 1e3))
+
+
+async def serve_forever(socket_path):
+    csp, ob = make_world()
+    async with PlanningService(csp, ob) as service:
+        server = await serve_unix(service, socket_path)
+        async with server:
+            await server.serve_forever()
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[1])
+    parser.add_argument("--vehicles", type=int, default=100)
+    parser.add_argument("--ticks", type=int, default=10)
+    parser.add_argument("--window", type=float, default=SERVICE_WINDOW,
+                        help="batching window [s]")
+    parser.add_argument("--unix", help="also benchmark over this socket")
+    parser.add_argument("--serve", help="serve the benchmark world on this "
+                                        "socket until interrupted")
+    args = parser.parse_args()
+
+    if args.serve:
+        asyncio.run(serve_forever(args.serve))
+    else:
+        asyncio.run(benchmark(args.vehicles, args.ticks, args.unix,
+                              args.window))
+
+
+if __name__ == '__main__':
+    main()
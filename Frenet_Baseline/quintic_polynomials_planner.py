@@ -5,18 +5,34 @@ Ref:
 - [Local Path planning And Motion Control For Agv In Positioning](http://ieeexplore.ieee.org/document/637936/)
 """
 
+import functools
 import math
 
-import matplotlib.pyplot as plt
 import numpy as np
 
 # parameter
 MAX_T = 100.0  # maximum time to the goal [s]
 MIN_T = 5.0  # minimum time to the goal[s]
+BOUNDARY_CACHE_SIZE = 256  # number of horizon times kept in the cache
 
 show_animation = True
 
 
+@functools.lru_cache(maxsize=BOUNDARY_CACHE_SIZE)
+def calc_quintic_boundary_inverse(time):
+    """
+    Inverse of the end-point boundary matrix of a quintic polynomial.
+    It depends only on the horizon `time`, so it is computed once per
+    distinct time and shared (read-only) by every caller.
+    """
+    A = np.array([[time ** 3, time ** 4, time ** 5],
+                  [3 * time ** 2, 4 * time ** 3, 5 * time ** 4],
+                  [6 * time, 12 * time ** 2, 20 * time ** 3]])
+    A_inv = np.linalg.inv(A)
+    A_inv.setflags(write=False)
+    return A_inv
+
+
 class QuinticPolynomial:
 
     def __init__(self, xs, vxs, axs, xe, vxe, axe, time):
@@ -26,13 +42,11 @@ class QuinticPolynomial:
         self.a1 = vxs
         self.a2 = axs / 2.0
 
-        A = np.array([[time ** 3, time ** 4, time ** 5],
-                      [3 * time ** 2, 4 * time ** 3, 5 * time ** 4],
-                      [6 * time, 12 * time ** 2, 20 * time ** 3]])
+        A_inv = calc_quintic_boundary_inverse(time)
         b = np.array([xe - self.a0 - self.a1 * time - self.a2 * time ** 2,
                       vxe - self.a1 - 2 * self.a2 * time,
                       axe - 2 * self.a2])
-        x = np.linalg.solve(A, b)
+        x = A_inv @ b
 
         self.a3 = x[0]
         self.a4 = x[1]
@@ -61,7 +75,250 @@ class QuinticPolynomial:
         return xt
 
 
-def quintic_polynomials_planner(sx, sy, syaw, sv, sa, gx, gy, gyaw, gv, ga, max_accel, max_jerk, dt):
+def stack_boundary_inverses(calc_inverse, time):
+    """
+    cached boundary inverses for every entry of `time`, one per row,
+    an empty stack for no entries
+    """
+    unique, inverse = np.unique(time, return_inverse=True)
+    if len(unique) == 0:
+        return np.zeros((0,) + calc_inverse(1.0).shape)
+    return np.stack([calc_inverse(float(T)) for T in unique])[inverse]
+
+
+@functools.lru_cache(maxsize=BOUNDARY_CACHE_SIZE)
+def calc_polynomial_basis(order, n_diff, t):
+    """
+    Basis matrices of a time grid for PolynomialBatch.evaluate, cached per
+    (order, n_diff, grid). t is a tuple of sample times.
+    return: (n_diff + 1, len(t), order + 1) array, one matrix per
+        derivative order
+    """
+    t = np.array(t)
+    k = np.arange(order + 1)
+    basis = np.zeros((n_diff + 1, len(t), order + 1))
+    for n in range(n_diff + 1):
+        # d^n/dt^n t^k = k! / (k - n)! * t^(k - n)
+        factor = np.ones(order + 1)
+        for j in range(n):
+            factor *= np.maximum(k - j, 0)
+        basis[n] = factor * np.power.outer(t, np.maximum(k - n, 0))
+    basis.setflags(write=False)
+    return basis
+
+
+class PolynomialBatch:
+    """
+    Many polynomials of one order, coefficients stored as an
+    (n, order + 1) array with the lowest order first
+    """
+
+    def __init__(self, coefficients):
+        self.coefficients = np.asarray(coefficients, dtype=float)
+
+    def __len__(self):
+        return len(self.coefficients)
+
+    @property
+    def order(self):
+        return self.coefficients.shape[1] - 1
+
+    def evaluate(self, t, n_diff=0):
+        """
+        position and the first n_diff derivatives
+        t: time grid shared by every polynomial, or an (n, 1) array of
+            one time per polynomial
+        return: list of n_diff + 1 arrays, (n, len(t)) for a shared grid
+        """
+        t = np.asarray(t, dtype=float)
+        if t.ndim == 1:
+            # a few matrix products with the cached basis of the grid
+            # beat the Horner pass's many elementwise passes
+            basis = calc_polynomial_basis(self.order, n_diff,
+                                          tuple(t.tolist()))
+            return [self.coefficients @ b.T for b in basis]
+        return self.evaluate_horner(t, n_diff)
+
+    def evaluate_horner(self, t, n_diff=0):
+        """
+        evaluate in one Horner pass carrying all n_diff derivatives, for
+        any t broadcasting against (n, 1)
+        """
+        t = np.asarray(t, dtype=float)
+        c = self.coefficients
+        # r[j] holds the j-th derivative divided by j!
+        r = [np.broadcast_to(c[:, -1:], np.broadcast_shapes(
+            (len(c), 1), t.shape)).copy()]
+        r += [np.zeros_like(r[0]) for _ in range(n_diff)]
+        for k in range(self.order - 1, -1, -1):
+            for j in range(min(n_diff, self.order - k), 0, -1):
+                r[j] *= t
+                r[j] += r[j - 1]
+            r[0] *= t
+            r[0] += c[:, k:k + 1]
+        return [math.factorial(j) * r[j] for j in range(n_diff + 1)]
+
+    def __add__(self, other):
+        a, b = self.coefficients, other.coefficients
+        order = max(a.shape[1], b.shape[1])
+        return PolynomialBatch(np.pad(a, ((0, 0), (0, order - a.shape[1]))) +
+                               np.pad(b, ((0, 0), (0, order - b.shape[1]))))
+
+    def derivative(self, n=1):
+        """
+        the n-th derivatives, a batch n orders lower
+        """
+        if n > self.order:
+            return PolynomialBatch(np.zeros((len(self), 1)))
+        k = np.arange(n, self.order + 1)
+        factor = np.ones(len(k))
+        for j in range(n):
+            factor *= k - j
+        return PolynomialBatch(self.coefficients[:, n:] * factor)
+
+    def integral(self):
+        """
+        the antiderivatives vanishing at t = 0, a batch one order higher
+        """
+        c = self.coefficients / np.arange(1, self.order + 2)
+        return PolynomialBatch(np.pad(c, ((0, 0), (1, 0))))
+
+    def square(self):
+        """
+        the squared polynomials, a batch of twice the order
+        """
+        c = self.coefficients
+        sq = np.zeros((len(c), 2 * self.order + 1))
+        for k in range(self.order + 1):
+            sq[:, k:k + self.order + 1] += c[:, k:k + 1] * c
+        return PolynomialBatch(sq)
+
+    def roots(self):
+        """
+        real parts of the complex roots of every polynomial, eigenvalues
+        of its companion matrix from the third order on, as an
+        (n, order) array padded with NaN. A superset of the real roots,
+        so extrema searched among them are never missed.
+        """
+        c = self.coefficients
+        roots = np.full((len(self), max(self.order, 0)), np.nan)
+        if self.order < 1:
+            return roots
+        lead = c[:, -1]
+        full = lead != 0.0
+        if self.order == 1:
+            roots[full, 0] = -c[full, 0] / lead[full]
+        elif self.order == 2:
+            a, b = lead[full], c[full, 1]
+            root = np.sqrt(np.maximum(b ** 2 - 4.0 * a * c[full, 0], 0.0))
+            roots[full] = np.column_stack([-b - root, -b + root]) / \
+                (2.0 * a[:, None])
+        elif np.any(full):
+            companion = np.zeros((np.sum(full), self.order, self.order))
+            companion[:, 1:, :-1] = np.eye(self.order - 1)
+            companion[:, :, -1] = -c[full, :-1] / lead[full, None]
+            roots[full] = np.linalg.eigvals(companion).real
+        # a vanishing leading coefficient leaves a lower order polynomial
+        if not np.all(full):
+            roots[~full, :-1] = PolynomialBatch(c[~full, :-1]).roots()
+        return roots
+
+    def bounds(self, lo, hi):
+        """
+        exact minimum and maximum of every polynomial over [lo, hi], from
+        its values at both ends and at the roots of its derivative
+        lo, hi: one interval for all polynomials or one per polynomial
+        """
+        lo, hi = [np.broadcast_to(np.asarray(v, dtype=float), (len(self),))
+                  [:, None] for v in (lo, hi)]
+        t = self.derivative().roots()
+        t = np.clip(np.where(np.isnan(t), lo, t), lo, hi)
+        value = self.evaluate_horner(np.column_stack([lo, hi, t]))[0]
+        return np.min(value, axis=1), np.max(value, axis=1)
+
+    def integrate_square(self, time, n_diff=0):
+        """
+        closed-form integral of the squared n_diff-th derivative over
+        [0, time], e.g. the squared jerk with n_diff=3
+        time: one horizon for all polynomials or one per polynomial
+        """
+        p = self.derivative(n_diff) if n_diff > 0 else self
+        T = np.broadcast_to(np.asarray(time, dtype=float), (len(self),))
+        return p.square().integral().evaluate(T[:, None])[0][:, 0]
+
+
+class QuinticPolynomialBatch(PolynomialBatch):
+    """
+    Batched QuinticPolynomial: one polynomial per entry of the broadcast
+    boundary conditions
+    A_inv: boundary inverses per entry, looked up from the cache if None
+    """
+
+    def __init__(self, xs, vxs, axs, xe, vxe, axe, time, A_inv=None):
+        xs, vxs, axs, xe, vxe, axe, time = np.broadcast_arrays(
+            *[np.asarray(v, dtype=float) for v in
+              (xs, vxs, axs, xe, vxe, axe, time)])
+        a0 = xs.ravel()
+        a1 = vxs.ravel()
+        a2 = axs.ravel() / 2.0
+        T = time.ravel()
+
+        b = np.stack([xe.ravel() - a0 - a1 * T - a2 * T ** 2,
+                      vxe.ravel() - a1 - 2 * a2 * T,
+                      axe.ravel() - 2 * a2], axis=-1)
+        if A_inv is None:
+            A_inv = stack_boundary_inverses(calc_quintic_boundary_inverse, T)
+        x = np.einsum("nij,nj->ni", A_inv, b)
+
+        super().__init__(np.column_stack([a0, a1, a2, x]))
+
+
+def calc_max_norm(px, py, t_end):
+    """
+    exact maximum of |(px(t), py(t))| over [0, t_end] for batches of
+    planar polynomials, e.g. the accel or jerk of a quintic trajectory.
+    The extrema of the squared norm lie at the roots of its derivative,
+    eigenvalues of a companion matrix for these orders.
+    """
+    _, max_square = (px.square() + py.square()).bounds(0.0, t_end)
+    return np.sqrt(np.maximum(max_square, 0.0))
+
+
+def calc_horizon_trajectories(sx, vxs, axs, gx, vxg, axg,
+                              sy, vys, ays, gy, vyg, ayg, horizons, dt):
+    """
+    trajectories of several horizon times as arrays of shape
+    (len(horizons), n), padded with NaN after the end of each horizon,
+    matching the per-sample loop of quintic_polynomials_planner up to
+    rounding
+    return: time, x, y, yaw, v, a, j arrays and the number of samples of
+        each horizon
+    """
+    n_point = np.array([len(np.arange(0.0, T + dt, dt)) for T in horizons])
+    t = np.arange(0.0, horizons[np.argmax(n_point)] + dt, dt)
+    valid = np.arange(len(t))[None, :] < n_point[:, None]
+
+    rx, vx, ax, jx = QuinticPolynomialBatch(
+        sx, vxs, axs, gx, vxg, axg, horizons).evaluate(t, 3)
+    ry, vy, ay, jy = QuinticPolynomialBatch(
+        sy, vys, ays, gy, vyg, ayg, horizons).evaluate(t, 3)
+    rv = np.hypot(vx, vy)
+    ryaw = np.arctan2(vy, vx)
+
+    # accel is negative while the speed drops, jerk while the accel drops
+    ra = np.hypot(ax, ay)
+    ra[:, 1:][np.diff(rv, axis=1) < 0.0] *= -1
+    rj = np.hypot(jx, jy)
+    rj[:, 1:][np.diff(ra, axis=1) < 0.0] *= -1
+
+    time = np.broadcast_to(t, rx.shape).copy()
+    for a in (time, rx, ry, ryaw, rv, ra, rj):
+        a[~valid] = np.nan
+    return time, rx, ry, ryaw, rv, ra, rj, n_point
+
+
+def quintic_polynomials_planner(sx, sy, syaw, sv, sa, gx, gy, gyaw, gv, ga, max_accel, max_jerk, dt,
+                                batched=True):
     """
     quintic polynomial planner
     input
@@ -83,6 +340,12 @@ def quintic_polynomials_planner(sx, sy, syaw, sv, sa, gx, gy, gyaw, gv, ga, max_
         ryaw: yaw angle result list
         rv: velocity result list
         ra: accel result list
+        rj: jerk result list
+    batched: check the accel and jerk limits of every horizon time
+        exactly from the polynomial coefficients, then sample only the
+        first feasible one as arrays. Limits broken between samples are
+        caught, so the horizon can come out later than with the per-sample
+        loop, never earlier.
     """
 
     vxs = sv * math.cos(syaw)
@@ -95,9 +358,30 @@ def quintic_polynomials_planner(sx, sy, syaw, sv, sa, gx, gy, gyaw, gv, ga, max_
     axg = ga * math.cos(gyaw)
     ayg = ga * math.sin(gyaw)
 
+    horizons = np.arange(MIN_T, MAX_T, MIN_T)
+    if batched and len(horizons) > 0:
+        # check every horizon from its coefficients, up to its last sample
+        # time, then sample only the chosen one
+        t_end = np.array([np.arange(0.0, T + dt, dt)[-1] for T in horizons])
+        xqp = QuinticPolynomialBatch(sx, vxs, axs, gx, vxg, axg, horizons)
+        yqp = QuinticPolynomialBatch(sy, vys, ays, gy, vyg, ayg, horizons)
+        ok = (calc_max_norm(xqp.derivative(2), yqp.derivative(2), t_end)
+              <= max_accel) & \
+            (calc_max_norm(xqp.derivative(3), yqp.derivative(3), t_end)
+             <= max_jerk)
+
+        # without a feasible horizon the last one is returned
+        i = int(np.argmax(ok)) if np.any(ok) else len(ok) - 1
+        if ok[i]:
+            print("find path!!")
+        result = calc_horizon_trajectories(
+            sx, vxs, axs, gx, vxg, axg, sy, vys, ays, gy, vyg, ayg,
+            horizons[i:i + 1], dt)
+        return tuple(a[0, :result[-1][0]].tolist() for a in result[:-1])
+
     time, rx, ry, ryaw, rv, ra, rj = [], [], [], [], [], [], []
 
-    for T in np.arange(MIN_T, MAX_T, MIN_T):
+    for T in horizons:
         xqp = QuinticPolynomial(sx, vxs, axs, gx, vxg, axg, T)
         yqp = QuinticPolynomial(sy, vys, ays, gy, vyg, ayg, T)
 
@@ -133,31 +417,40 @@ def quintic_polynomials_planner(sx, sy, syaw, sv, sa, gx, gy, gyaw, gv, ga, max_
             print("find path!!")
             break
 
-    if show_animation:  # pragma: no cover
-        for i, _ in enumerate(time):
-            plt.cla()
-            # for stopping simulation with the esc key.
-            plt.gcf().canvas.mpl_connect('key_release_event',
-                                         lambda event: [exit(0) if event.key == 'escape' else None])
-            plt.grid(True)
-            plt.axis("equal")
-            plot_arrow(sx, sy, syaw)
-            plot_arrow(gx, gy, gyaw)
-            plot_arrow(rx[i], ry[i], ryaw[i])
-            plt.title("Time[s]:" + str(time[i])[0:4] +
-                      " v[m/s]:" + str(rv[i])[0:4] +
-                      " a[m/ss]:" + str(ra[i])[0:4] +
-                      " jerk[m/sss]:" + str(rj[i])[0:4],
-                      )
-            plt.pause(0.001)
-
     return time, rx, ry, ryaw, rv, ra, rj
 
 
+def animate_trajectory(sx, sy, syaw, gx, gy, gyaw, time, rx, ry, ryaw, rv,
+                       ra, rj):  # pragma: no cover
+    """
+    Replay a planned trajectory, kept apart from quintic_polynomials_planner
+    so that planning never waits on drawing
+    """
+    import matplotlib.pyplot as plt
+
+    # for stopping simulation with the esc key.
+    plt.gcf().canvas.mpl_connect('key_release_event',
+                                 lambda event: [exit(0) if event.key == 'escape' else None])
+    for i, _ in enumerate(time):
+        plt.cla()
+        plt.grid(True)
+        plt.axis("equal")
+        plot_arrow(sx, sy, syaw)
+        plot_arrow(gx, gy, gyaw)
+        plot_arrow(rx[i], ry[i], ryaw[i])
+        plt.title("Time[s]:" + str(time[i])[0:4] +
+                  " v[m/s]:" + str(rv[i])[0:4] +
+                  " a[m/ss]:" + str(ra[i])[0:4] +
+                  " jerk[m/sss]:" + str(rj[i])[0:4],
+                  )
+        plt.pause(0.001)
+
+
 def plot_arrow(x, y, yaw, length=1.0, width=0.5, fc="r", ec="k"):  # pragma: no cover
     """
     Plot arrow
     """
+    import matplotlib.pyplot as plt
 
     if not isinstance(x, float):
         for (ix, iy, iyaw) in zip(x, y, yaw):
@@ -189,6 +482,10 @@ def main():
         sx, sy, syaw, sv, sa, gx, gy, gyaw, gv, ga, max_accel, max_jerk, dt)
 
     if show_animation:  # pragma: no cover
+        import matplotlib.pyplot as plt
+
+        animate_trajectory(sx, sy, syaw, gx, gy, gyaw, time, x, y, yaw, v,
+                           a, j)
         plt.plot(x, y, "-r")
 
         plt.subplots()
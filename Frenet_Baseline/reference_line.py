@@ -0,0 +1,196 @@
+"""
+Dense arc-length lookup table for a reference line
+
+ReferenceLine samples a CubicSpline2D once at a fixed s resolution
+(x, y, dx/ds, dy/ds and curvature per sample) and afterwards answers
+the array queries of the Frenet planner by direct indexing, with no
+segment search: positions by cubic Hermite interpolation between
+samples, yaw from the interpolated tangent and curvature linearly.
+
+The table is a single float64 array, so it can be saved as a .npy file
+and memory-mapped back, and repeated runs on the same route skip spline
+construction altogether:
+
+>>> ref = ReferenceLine.cached(wx, wy, cache_dir="route_cache")
+"""
+
+import hashlib
+import pathlib
+import sys
+
+import numpy as np
+
+sys.path.append(str(pathlib.Path(__file__).parent))
+
+import cubic_spline_planner
+
+DS = 0.1  # table resolution [m]
+
+# table columns
+S, X, Y, DX, DY, K = range(6)
+N_COLUMN = 6
+
+
+class ReferenceLine:
+
+    def __init__(self, table):
+        """
+        table: (n, 6) array with the columns s, x, y, dx, dy, k,
+            s spaced uniformly except for the last sample at the course end
+        """
+        self.table = table
+        self.ds = float(table[1, S] - table[0, S])
+        self.s = table[:, S]
+        self.length = float(table[-1, S])
+
+    def __len__(self):
+        return len(self.table)
+
+    @classmethod
+    def from_spline(cls, csp, ds=DS):
+        length = csp.s[-1]
+        s = np.append(np.arange(0.0, length, ds), length)
+        if len(s) > 2 and s[-1] - s[-2] < 1e-9:
+            s = np.delete(s, -2)
+
+        table = np.empty((len(s), N_COLUMN))
+        table[:, S] = s
+        table[:, X], table[:, Y] = csp.calc_position_array(s)
+        table[:, DX] = csp.sx.calc_first_derivative_array(s)
+        table[:, DY] = csp.sy.calc_first_derivative_array(s)
+        table[:, K] = csp.calc_curvature_array(s)
+        return cls(table)
+
+    @classmethod
+    def from_waypoints(cls, x, y, ds=DS):
+        return cls.from_spline(cubic_spline_planner.CubicSpline2D(x, y), ds)
+
+    def save(self, path):
+        np.save(path, self.table)
+
+    @classmethod
+    def load(cls, path, mmap=True):
+        """
+        load a saved table, memory-mapped read-only by default
+        """
+        return cls(np.load(path, mmap_mode="r" if mmap else None))
+
+    @classmethod
+    def cached(cls, x, y, ds=DS, cache_dir="."):
+        """
+        the reference line of way points `x`, `y`, loaded from
+        `cache_dir` if this route was built before, else built and saved
+        """
+        key = hashlib.sha1(np.array([ds, N_COLUMN, *x, *y],
+                                    dtype=float).tobytes())
+        path = pathlib.Path(cache_dir) / ("reference_%s.npy"
+                                          % key.hexdigest()[:16])
+        if path.exists():
+            return cls.load(path)
+        ref = cls.from_waypoints(x, y, ds)
+        path.parent.mkdir(parents=True, exist_ok=True)
+        ref.save(path)
+        return ref
+
+    def __search_index_array(self, s):
+        """
+        sample index and position in the sample cell for an array of s,
+        in O(1) per s
+        """
+        s = np.asarray(s, dtype=float)
+        inside = (s >= 0.0) & (s <= self.length)
+        i = np.floor(np.where(inside, s, 0.0) / self.ds).astype(np.int64)
+        i = np.clip(i, 0, len(self.table) - 2)
+        h = self.s[i + 1] - self.s[i]
+        u = (np.where(inside, s, 0.0) - self.s[i]) / h
+        return i, u, h, inside
+
+    def calc_position_array(self, s):
+        """
+        x and y for an array of s, NaN outside the course
+        """
+        i, u, h, inside = self.__search_index_array(s)
+        u2 = u * u
+        u3 = u2 * u
+        h00 = 2.0 * u3 - 3.0 * u2 + 1.0
+        h10 = u3 - 2.0 * u2 + u
+        h01 = -2.0 * u3 + 3.0 * u2
+        h11 = u3 - u2
+        t0, t1 = self.table[i], self.table[i + 1]
+        x = h00 * t0[..., X] + h10 * h * t0[..., DX] + \
+            h01 * t1[..., X] + h11 * h * t1[..., DX]
+        y = h00 * t0[..., Y] + h10 * h * t0[..., DY] + \
+            h01 * t1[..., Y] + h11 * h * t1[..., DY]
+        return np.where(inside, x, np.nan), np.where(inside, y, np.nan)
+
+    def calc_tangent_array(self, s):
+        """
+        derivatives dx/ds and dy/ds of the interpolated positions for an
+        array of s
+        """
+        i, u, h, inside = self.__search_index_array(s)
+        u2 = u * u
+        d00 = 6.0 * u2 - 6.0 * u
+        d10 = 3.0 * u2 - 4.0 * u + 1.0
+        d11 = 3.0 * u2 - 2.0 * u
+        t0, t1 = self.table[i], self.table[i + 1]
+        dx = d00 * (t0[..., X] - t1[..., X]) + \
+            h * (d10 * t0[..., DX] + d11 * t1[..., DX])
+        dy = d00 * (t0[..., Y] - t1[..., Y]) + \
+            h * (d10 * t0[..., DY] + d11 * t1[..., DY])
+        return (np.where(inside, dx / h, np.nan),
+                np.where(inside, dy / h, np.nan))
+
+    def calc_tangent_rate_array(self, s):
+        """
+        second derivatives d2x/ds2 and d2y/ds2 of the interpolated
+        positions for an array of s
+        """
+        i, u, h, inside = self.__search_index_array(s)
+        e00 = 12.0 * u - 6.0
+        e10 = 6.0 * u - 4.0
+        e11 = 6.0 * u - 2.0
+        t0, t1 = self.table[i], self.table[i + 1]
+        ddx = e00 * (t0[..., X] - t1[..., X]) + \
+            h * (e10 * t0[..., DX] + e11 * t1[..., DX])
+        ddy = e00 * (t0[..., Y] - t1[..., Y]) + \
+            h * (e10 * t0[..., DY] + e11 * t1[..., DY])
+        return (np.where(inside, ddx / h ** 2, np.nan),
+                np.where(inside, ddy / h ** 2, np.nan))
+
+    def calc_frame_array(self, s):
+        """
+        x, y, yaw, tangent length |r'(s)| and its derivative, curvature
+        and dk/ds for an array of s, as CubicSpline2D.calc_frame_array
+        """
+        x, y = self.calc_position_array(s)
+        dx, dy = self.calc_tangent_array(s)
+        ddx, ddy = self.calc_tangent_rate_array(s)
+        sigma = np.hypot(dx, dy)
+        sigma_d = (dx * ddx + dy * ddy) / sigma
+        return x, y, np.arctan2(dy, dx), sigma, sigma_d, \
+            self.calc_curvature_array(s), self.calc_curvature_rate_array(s)
+
+    def calc_yaw_array(self, s):
+        """
+        yaw of the interpolated tangent for an array of s
+        """
+        dx, dy = self.calc_tangent_array(s)
+        return np.arctan2(dy, dx)
+
+    def calc_curvature_array(self, s):
+        """
+        linearly interpolated curvature for an array of s
+        """
+        i, u, h, inside = self.__search_index_array(s)
+        k = (1.0 - u) * self.table[i, K] + u * self.table[i + 1, K]
+        return np.where(inside, k, np.nan)
+
+    def calc_curvature_rate_array(self, s):
+        """
+        curvature derivative dk/ds for an array of s, the slope of the
+        linearly interpolated curvature
+        """
+        i, _, h, inside = self.__search_index_array(s)
+        dk = (self.table[i + 1, K] - self.table[i, K]) / h
+        return np.where(inside, dk, np.nan)
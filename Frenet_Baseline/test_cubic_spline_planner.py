@@ -0,0 +1,50 @@
+"""
+Checks of the cubic spline planner.
+
+usage:
+    python -m pytest test_cubic_spline_planner.py
+"""
+
+import pathlib
+import sys
+
+import numpy as np
+import pytest
+
+sys.path.append(str(pathlib.Path(__file__).parent))
+
+import cubic_spline_planner
+
+
+def dense_coefficient_c(x, y):
+    """
+    c of the natural cubic spline through `x`, `y` from a dense solve of
+    its full linear system
+    """
+    n = len(x)
+    h = np.diff(x)
+    A = np.zeros((n, n))
+    B = np.zeros(n)
+    A[0, 0] = A[-1, -1] = 1.0
+    for i in range(1, n - 1):
+        A[i, i - 1:i + 2] = h[i - 1], 2.0 * (h[i - 1] + h[i]), h[i]
+        B[i] = 3.0 * (y[i + 1] - y[i]) / h[i] - \
+            3.0 * (y[i] - y[i - 1]) / h[i - 1]
+    return np.linalg.solve(A, B)
+
+
+@pytest.mark.parametrize("n", [2, 3, 5, 40])
+def test_tridiagonal_solve_matches_dense_solve(n):
+    rng = np.random.default_rng(n)
+    x = np.cumsum(rng.uniform(0.1, 5.0, n))
+    y = rng.uniform(-10.0, 10.0, n)
+    sp = cubic_spline_planner.CubicSpline1D(x, y)
+
+    c = dense_coefficient_c(x, y)
+    np.testing.assert_allclose(sp.c, c, rtol=1e-10, atol=1e-12)
+    h = np.diff(x)
+    np.testing.assert_allclose(
+        sp.b, np.diff(y) / h - h / 3.0 * (2.0 * c[:-1] + c[1:]),
+        rtol=1e-10, atol=1e-12)
+    np.testing.assert_allclose(sp.d, np.diff(c) / (3.0 * h),
+                               rtol=1e-10, atol=1e-12)
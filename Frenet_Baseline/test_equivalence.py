@@ -0,0 +1,130 @@
+"""
+Regression checks of the planner's exact-equivalence claims: the
+best-first search, the parallel evaluation and the planning service
+choose the same path as the exhaustive search, and the obstacle grid
+finds the same collisions as a brute-force distance test.
+
+usage:
+    python -m pytest test_equivalence.py
+"""
+
+import asyncio
+import pathlib
+import sys
+
+import numpy as np
+import pytest
+
+sys.path.append(str(pathlib.Path(__file__).parent))
+
+import frenet_optimal_trajectory as fot
+import planning_service
+from fleet_planner import STATE_FIELDS, make_fleet
+from parallel_evaluation import ParallelEvaluator
+
+WX = [0.0, 10.0, 20.5, 35.0, 70.5]
+WY = [0.0, -6.0, 5.0, 6.5, 0.0]
+SEEDS = range(6)
+
+
+@pytest.fixture(scope="module")
+def csp():
+    _, _, _, _, csp = fot.generate_target_course(WX, WY)
+    return csp
+
+
+def scenario(seed):
+    """
+    a random state near the start of the course and obstacles along it
+    """
+    rng = np.random.default_rng(seed)
+    state = (rng.uniform(0.0, 10.0), rng.uniform(1.0, 8.0),
+             rng.uniform(-0.5, 0.5), rng.uniform(-3.0, 3.0),
+             rng.uniform(-0.5, 0.5), 0.0)
+    ob = np.column_stack([rng.uniform(0.0, 70.0, 20),
+                          rng.uniform(-8.0, 10.0, 20)])
+    return state, ob
+
+
+def assert_same_path(a, b):
+    assert (a is None) == (b is None)
+    if a is not None:
+        assert a.cf == b.cf
+        np.testing.assert_array_equal(a.x, b.x)
+        np.testing.assert_array_equal(a.y, b.y)
+
+
+@pytest.mark.parametrize("seed", SEEDS)
+def test_best_first_matches_exhaustive(csp, seed):
+    state, ob = scenario(seed)
+    assert_same_path(
+        fot.frenet_optimal_planning(csp, *state, ob),
+        fot.frenet_optimal_planning(csp, *state, ob, best_first=False))
+
+
+@pytest.fixture(scope="module")
+def evaluator():
+    with ParallelEvaluator(processes=2, min_candidates=10) as evaluator:
+        yield evaluator
+
+
+@pytest.mark.parametrize("seed", SEEDS)
+def test_parallel_matches_serial(csp, evaluator, seed):
+    state, ob = scenario(seed)
+    assert_same_path(
+        fot.frenet_optimal_planning(csp, *state, ob, best_first=False),
+        fot.frenet_optimal_planning(csp, *state, ob, evaluator=evaluator))
+
+
+def brute_force_clear(paths, ob, radius):
+    """
+    True for candidates with no point within `radius` of an obstacle,
+    static (n, 2) or trajectories (n, n_slice, 2) held after their end
+    """
+    ob = np.asarray(ob, dtype=float)
+    if ob.ndim == 2:
+        ob = ob[:, None, :]
+    step = np.minimum(np.arange(paths.x.shape[1]), ob.shape[1] - 1)
+    dx = paths.x[:, :, None] - ob[:, step, 0].T[None]
+    dy = paths.y[:, :, None] - ob[:, step, 1].T[None]
+    return ~np.any(dx ** 2 + dy ** 2 <= radius ** 2, axis=(1, 2))
+
+
+@pytest.mark.parametrize("seed", SEEDS)
+def test_collision_matches_brute_force(csp, seed):
+    state, ob = scenario(seed)
+    rng = np.random.default_rng(seed)
+    paths = fot.calc_global_paths(
+        fot.calc_frenet_paths(*state[1:], state[0]), csp)
+
+    # static points with far outliers
+    static = np.vstack([ob, rng.uniform(-5000.0, 5000.0, (5, 2))])
+    # moving obstacles, one absent for a few slices
+    start = np.column_stack([rng.uniform(-5.0, 70.0, 30),
+                             rng.uniform(-15.0, 15.0, 30)])
+    moving = start[:, None, :] + rng.normal(0.0, 3.0, (30, 1, 2)) * \
+        np.arange(20)[None, :, None] * fot.DT
+    moving[3, 5:9] = np.nan
+
+    for obstacles in (static, moving, np.zeros((0, 2))):
+        np.testing.assert_array_equal(
+            fot.check_collision(paths, obstacles),
+            brute_force_clear(paths, obstacles, fot.ROBOT_RADIUS))
+
+
+def test_service_matches_planner():
+    csp, ob = planning_service.make_world()
+    states = make_fleet(30, 1000.0)
+    vehicles = [tuple(float(states[key][i]) for key in STATE_FIELDS)
+                for i in range(30)]
+
+    async def plan_all():
+        async with planning_service.PlanningService(csp, ob) as service:
+            return await asyncio.gather(
+                *[service.plan(*state) for state in vehicles])
+
+    results = asyncio.run(plan_all())
+    grid = fot.ObstacleGrid(ob, fot.ROBOT_RADIUS)
+    for state, result in zip(vehicles, results):
+        assert_same_path(result["path"],
+                         fot.frenet_optimal_planning(csp, *state, grid))
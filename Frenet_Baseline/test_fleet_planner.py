@@ -0,0 +1,62 @@
+"""
+Checks of the fleet planner.
+
+usage:
+    python -m pytest test_fleet_planner.py
+"""
+
+import pathlib
+import sys
+
+import numpy as np
+import pytest
+
+sys.path.append(str(pathlib.Path(__file__).parent))
+
+import frenet_optimal_trajectory as fot
+from fleet_planner import FleetPlanner, make_fleet
+
+LENGTH = 300.0  # course length [m]
+OB = np.array([[100.0, 5.0], [150.0, -3.0]])
+
+
+@pytest.fixture(scope="module")
+def csp():
+    wx = np.linspace(0.0, LENGTH, 11)
+    wy = 10.0 * np.sin(wx / LENGTH * 4.0 * np.pi)
+    _, _, _, _, csp = fot.generate_target_course(wx, wy)
+    return csp
+
+
+def count_conflicts(paths):
+    """
+    pairs of paths closer than two robot radii at a common time step
+    """
+    n = 0
+    for j, b in enumerate(paths):
+        for a in paths[:j]:
+            if a is None or b is None:
+                continue
+            m = min(len(a.x), len(b.x))
+            gap = np.hypot(np.subtract(a.x[:m], b.x[:m]),
+                           np.subtract(a.y[:m], b.y[:m]))
+            n += np.any(gap <= 2.0 * fot.ROBOT_RADIUS)
+    return n
+
+
+@pytest.mark.parametrize("seed", range(3))
+def test_fleet_paths_are_conflict_free(csp, seed):
+    state = make_fleet(30, LENGTH, seed=seed)
+    planner = FleetPlanner(csp, OB)
+    # planned on their own, some agents collide
+    assert count_conflicts(planner.plan(**state, independent=True)) > 0
+
+    paths = planner.plan(**state)
+    assert count_conflicts(paths) == 0
+    assert sum(path is not None for path in paths) > 20
+    # the first agent has priority and plans as if alone
+    single = fot.frenet_optimal_planning(
+        csp, state["s0"][0], state["c_speed"][0], state["c_accel"][0],
+        state["c_d"][0], state["c_d_d"][0], state["c_d_dd"][0], OB)
+    assert paths[0].cf == single.cf
+    np.testing.assert_array_equal(paths[0].x, single.x)
@@ -0,0 +1,113 @@
+"""
+Behavioral checks of the Frenet optimal planner.
+
+usage:
+    python -m pytest test_frenet_optimal_trajectory.py
+"""
+
+import concurrent.futures
+import dataclasses
+import pathlib
+import sys
+
+import numpy as np
+import pytest
+
+sys.path.append(str(pathlib.Path(__file__).parent))
+
+import frenet_optimal_trajectory as fot
+from fleet_planner import FleetPlanner
+
+WX = [0.0, 10.0, 20.5, 35.0, 70.5]
+WY = [0.0, -6.0, 5.0, 6.5, 0.0]
+STATE = (0.0, 10.0 / 3.6, 0.0, 2.0, 0.0, 0.0)
+OB = np.array([[20.0, 10.0], [30.0, 6.0], [35.0, 8.0]])
+
+
+@pytest.fixture(scope="module")
+def csp():
+    _, _, _, _, csp = fot.generate_target_course(WX, WY)
+    return csp
+
+
+@pytest.mark.parametrize("change", [dict(min_t=5.0, max_t=5.0),
+                                    dict(n_s_sample=0),
+                                    dict(max_road_width=0.0)])
+def test_empty_lattice_has_no_path(csp, change):
+    config = dataclasses.replace(fot.PlannerConfig.from_globals(),
+                                 **change)
+    assert len(config.lattice()) == 0
+
+    paths = fot.calc_frenet_paths(*STATE[1:], STATE[0], config=config)
+    assert len(paths) == 0
+    assert fot.find_best_path(paths, csp, OB, config=config) is None
+    for best_first in (True, False):
+        assert fot.frenet_optimal_planning(
+            csp, *STATE, OB, best_first=best_first, config=config) is None
+    assert fot.FrenetPlanner(config).plan(csp, *STATE, OB) is None
+    assert FleetPlanner(csp, OB, config).plan(
+        [0.0, 10.0], [3.0, 3.0], [0.0, 0.0], [2.0, -2.0], [0.0, 0.0],
+        [0.0, 0.0]) == [None, None]
+
+
+@pytest.mark.parametrize("seed", range(6))
+def test_exact_limits_never_accept_a_sampled_violation(seed):
+    rng = np.random.default_rng(seed)
+    s0 = rng.uniform(0.0, 50.0, 20)
+    c_speed = rng.uniform(0.0, 1.2 * fot.MAX_SPEED, 20)
+    c_accel = rng.uniform(-3.0, 3.0, 20)
+    paths = fot.calc_frenet_paths(c_speed, c_accel, np.zeros(20),
+                                  np.zeros(20), np.zeros(20), s0)
+
+    sampled_ok = ~np.any((paths.s_d > fot.MAX_SPEED) |
+                         (np.abs(paths.s_dd) > fot.MAX_ACCEL), axis=1)
+    assert np.any(paths.limits_ok) and not np.all(paths.limits_ok)
+    assert np.all(sampled_ok[paths.limits_ok])
+
+
+def test_cartesian_to_frenet_inverts_calc_global_paths(csp):
+    paths = fot.calc_global_paths(
+        fot.calc_frenet_paths(*STATE[1:], STATE[0]), csp)
+    # moving samples on the course, well clear of the centre of
+    # curvature where the projection is no longer unique, projected from
+    # a nearby s as IncrementalPlanner.localize does
+    kd = csp.calc_curvature_array(paths.s) * paths.d
+    on_course = ~np.isnan(paths.x) & ~np.isnan(paths.yaw) & \
+        (paths.s_d > 0.1) & (kd < 0.5)
+    assert np.sum(on_course) > 1000
+
+    s, s_d, _, d, d_p, _ = fot.cartesian_to_frenet(
+        csp, paths.x[on_course], paths.y[on_course],
+        paths.yaw[on_course], paths.v[on_course],
+        s_guess=paths.s[on_course] + 0.5)
+    np.testing.assert_allclose(s, paths.s[on_course], atol=1e-6)
+    np.testing.assert_allclose(d, paths.d[on_course], atol=1e-6)
+    np.testing.assert_allclose(s_d, paths.s_d[on_course], atol=1e-6)
+    np.testing.assert_allclose(d_p * s_d, paths.d_d[on_course], atol=1e-6)
+
+
+def test_planner_is_thread_safe_across_configs(csp):
+    car = fot.FrenetPlanner()
+    truck = fot.FrenetPlanner(dataclasses.replace(
+        fot.PlannerConfig.from_globals(), max_speed=20.0 / 3.6,
+        max_accel=1.0, d_road_w=0.5, robot_radius=3.0,
+        target_speed=15.0 / 3.6))
+    rng = np.random.default_rng(0)
+    jobs = [(planner, (rng.uniform(0.0, 40.0), rng.uniform(1.0, 8.0), 0.0,
+                       rng.uniform(-2.0, 2.0), 0.0, 0.0))
+            for _ in range(40) for planner in (car, truck)]
+
+    def plan(job):
+        planner, state = job
+        path = planner.plan(csp, *state, OB)
+        return None if path is None else (path.cf, path.x)
+
+    # first use of both planners from many threads at once
+    with concurrent.futures.ThreadPoolExecutor(8) as executor:
+        threaded = list(executor.map(plan, jobs))
+    serial = [fot.frenet_optimal_planning(csp, *state, OB,
+                                          config=planner.config)
+              for planner, state in jobs]
+    assert threaded == [None if path is None else (path.cf, path.x)
+                        for path in serial]
+    assert threaded[::2] != threaded[1::2]
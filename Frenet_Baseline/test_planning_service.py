@@ -0,0 +1,39 @@
+"""
+Lifecycle checks of the planning service.
+
+usage:
+    python -m pytest test_planning_service.py
+"""
+
+import asyncio
+import pathlib
+import sys
+
+import pytest
+
+sys.path.append(str(pathlib.Path(__file__).parent))
+
+import planning_service
+
+STATE = (0.0, 10.0 / 3.6, 0.0, 2.0, 0.0, 0.0)
+
+
+@pytest.fixture(scope="module")
+def world():
+    return planning_service.make_world()
+
+
+def test_close_before_start(world):
+    async def run():
+        service = planning_service.PlanningService(*world)
+        with pytest.raises(RuntimeError, match="not started"):
+            await service.plan(*STATE)
+        await service.close()
+        with pytest.raises(RuntimeError, match="closed"):
+            await service.plan(*STATE)
+
+    asyncio.run(run())
+
+
+def test_client_close_before_connect():
+    asyncio.run(planning_service.PlanningClient("unused.sock").close())
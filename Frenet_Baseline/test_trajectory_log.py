@@ -0,0 +1,65 @@
+"""
+Checks of the trajectory log.
+
+usage:
+    python -m pytest test_trajectory_log.py
+"""
+
+import pathlib
+import sys
+
+import numpy as np
+import pytest
+
+sys.path.append(str(pathlib.Path(__file__).parent))
+
+import frenet_optimal_trajectory as fot
+import trajectory_log
+
+WX = [0.0, 10.0, 20.5, 35.0, 70.5]
+WY = [0.0, -6.0, 5.0, 6.5, 0.0]
+OB = np.array([[20.0, 10.0], [30.0, 6.0], [30.0, 8.0], [35.0, 8.0]])
+
+
+@pytest.fixture(scope="module")
+def cycles():
+    return list(fot.simulate(WX, WY, OB, sim_loop=20))
+
+
+@pytest.mark.parametrize("mmap", [True, False])
+def test_log_round_trip(tmp_path, cycles, mmap):
+    path = tmp_path / "run.frlog"
+    # a chunk smaller than the run so that several writes are appended
+    with trajectory_log.TrajectoryLogWriter(path, meta={"wx": WX},
+                                            chunk=7) as writer:
+        for record in cycles:
+            writer.append(record)
+
+    meta, records = trajectory_log.read_log(path, mmap=mmap)
+    assert meta == {"wx": WX}
+    assert len(records) == len(cycles)
+    for row, record in zip(records, cycles):
+        assert row["cycle"] == record["cycle"]
+        assert trajectory_log.STATUS[row["status"]] == record["status"]
+        assert row["latency"] == record["latency"]
+        assert tuple(row[name] for name in trajectory_log.STATE_FIELDS) \
+            == tuple(record["state"])
+        path = record["path"]
+        assert row["n_point"] == len(path.x)
+        assert row["cost"] == path.cf
+        for name in trajectory_log.PATH_FIELDS:
+            np.testing.assert_array_equal(
+                row["path_" + name][:len(path.x)],
+                np.float32(getattr(path, name)))
+            assert np.all(np.isnan(row["path_" + name][len(path.x):]))
+
+
+def test_log_cut_off_mid_record(tmp_path, cycles):
+    path = tmp_path / "run.frlog"
+    with trajectory_log.TrajectoryLogWriter(path) as writer:
+        for record in cycles[:5]:
+            writer.append(record)
+    with open(path, "ab") as f:
+        f.write(b"\0" * 10)
+    _, records = trajectory_log.read_log(path)
+    assert len(records) == 5
@@ -0,0 +1,219 @@
+"""
+Compact binary log of Frenet planner runs
+
+A log file is a small JSON header followed by fixed-size records of a
+NumPy structured dtype, one per planning cycle: the state planned from,
+the chosen path, its cost and the planning latency. The writer buffers
+LOG_CHUNK records and appends each full chunk with a single write, so a
+run of any length streams to disk in constant memory, and a log cut off
+by a crash stays readable up to its last complete record. read_log maps
+the records back without copying:
+
+>>> log_simulation("run.frlog", wx, wy, ob, sim_loop=100000)
+>>> header, records = read_log("run.frlog")
+>>> records["latency"].mean(), records["path_x"][-1]
+
+usage:
+    python trajectory_log.py run.frlog --run
+    python trajectory_log.py run.frlog --gif run.gif
+"""
+
+import argparse
+import json
+import pathlib
+import struct
+import sys
+
+import numpy as np
+
+sys.path.append(str(pathlib.Path(__file__).parent))
+
+import frenet_optimal_trajectory as fot
+
+LOG_MAGIC = b"FRNTLOG1"
+LOG_ALIGN = 64  # records start at a multiple of this [byte]
+LOG_CHUNK = 1024  # records buffered per write
+
+STATUS = ("running", "goal", "no_path")
+STATE_FIELDS = ("s0", "c_speed", "c_accel", "c_d", "c_d_d", "c_d_dd")
+# FrenetPath fields stored per record, float32 and NaN past the path end
+PATH_FIELDS = ("x", "y", "yaw", "v", "s", "d")
+
+
+def record_dtype(n_t):
+    """
+    record layout for paths of at most n_t points
+    """
+    return np.dtype(
+        [("cycle", np.int32), ("status", np.uint8), ("n_point", np.int16),
+         ("latency", np.float64), ("cost", np.float64)] +
+        [(name, np.float64) for name in STATE_FIELDS] +
+        [("path_" + name, np.float32, (n_t,)) for name in PATH_FIELDS],
+        align=True)
+
+
+def lattice_points(config=None):
+    """
+    number of time points of the longest path of the lattice of `config`,
+    of the module parameters if None
+    """
+    if config is None:
+        config = fot.PlannerConfig.from_globals()
+    return len(config.lattice().t)
+
+
+class TrajectoryLogWriter:
+    """
+    append-only writer of planner cycle records
+    n_t: maximum path length, that of the lattice of `config` if None
+    meta: JSON-serializable run description kept in the header, e.g. the
+        way points and obstacles for replay
+    """
+
+    def __init__(self, path, n_t=None, meta=None, chunk=LOG_CHUNK,
+                 config=None):
+        self.dtype = record_dtype(lattice_points(config) if n_t is None
+                                  else n_t)
+        self.buffer = np.zeros(chunk, dtype=self.dtype)
+        self.n_buffered = 0
+        self.n_written = 0
+
+        header = json.dumps({"descr": np.lib.format.dtype_to_descr(
+            self.dtype), "meta": meta or {}}).encode()
+        size = len(LOG_MAGIC) + 4 + len(header)
+        header += b" " * (-size % LOG_ALIGN)
+        self.file = open(path, "wb")
+        self.file.write(LOG_MAGIC + struct.pack("<I", len(header)) + header)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+    def append(self, record):
+        """
+        add one record from frenet_optimal_trajectory.simulate
+        """
+        row = self.buffer[self.n_buffered]
+        row["cycle"] = record["cycle"]
+        row["status"] = STATUS.index(record["status"])
+        row["latency"] = record["latency"]
+        for name, value in zip(STATE_FIELDS, record["state"]):
+            row[name] = value
+
+        path = record["path"]
+        n_t = self.dtype["path_x"].shape[0]
+        if path is None:
+            row["n_point"] = 0
+            row["cost"] = np.nan
+            for name in PATH_FIELDS:
+                row["path_" + name] = np.nan
+        else:
+            row["n_point"] = min(len(path.x), n_t)
+            row["cost"] = path.cf
+            for name in PATH_FIELDS:
+                value = getattr(path, name)[:n_t]
+                row["path_" + name][:len(value)] = value
+                row["path_" + name][len(value):] = np.nan
+
+        self.n_buffered += 1
+        if self.n_buffered == len(self.buffer):
+            self.flush()
+
+    def flush(self):
+        self.file.write(self.buffer[:self.n_buffered].tobytes())
+        self.file.flush()
+        self.n_written += self.n_buffered
+        self.n_buffered = 0
+
+    def close(self):
+        self.flush()
+        self.file.close()
+
+
+def read_log(path, mmap=True):
+    """
+    return: header meta dict and the records as a structured array,
+        memory-mapped read-only by default
+    """
+    with open(path, "rb") as f:
+        if f.read(len(LOG_MAGIC)) != LOG_MAGIC:
+            raise ValueError("not a trajectory log: %s" % path)
+        header_len, = struct.unpack("<I", f.read(4))
+        header = json.loads(f.read(header_len))
+    dtype = np.lib.format.descr_to_dtype(header["descr"])
+    offset = len(LOG_MAGIC) + 4 + header_len
+
+    # a trailing partial record, e.g. from a crash, is left out
+    n = (pathlib.Path(path).stat().st_size - offset) // dtype.itemsize
+    if mmap:
+        records = np.memmap(path, dtype=dtype, mode="r", offset=offset,
+                            shape=(n,))
+    else:
+        records = np.fromfile(path, dtype=dtype, count=n, offset=offset)
+    return header["meta"], records
+
+
+def log_simulation(path, wx, wy, ob, **kwargs):
+    """
+    run frenet_optimal_trajectory.simulate and stream every cycle into a
+    log at `path`, kwargs are passed on to simulate
+    return: the outcome, "goal", "no_path" or "timeout"
+    """
+    meta = {"wx": list(map(float, wx)), "wy": list(map(float, wy)),
+            "ob": np.asarray(ob, dtype=float).tolist()}
+    status = "timeout"
+    with TrajectoryLogWriter(path, meta=meta,
+                             config=kwargs.get("config")) as writer:
+        for record in fot.simulate(wx, wy, ob, **kwargs):
+            writer.append(record)
+            if record["status"] != "running":
+                status = record["status"]
+    return status
+
+
+def render_records(records):
+    """
+    cycle records for frenet_renderer.render_cycles
+    """
+    for row in records:
+        n = row["n_point"]
+        if n < 2:
+            continue
+        yield {"cycle": int(row["cycle"]),
+               "x": row["path_x"][:n].tolist(),
+               "y": row["path_y"][:n].tolist(),
+               "speed": float(row["c_speed"])}
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[1])
+    parser.add_argument("log", help="trajectory log file")
+    parser.add_argument("--run", action="store_true",
+                        help="write the log from the default simulation "
+                             "first")
+    parser.add_argument("--gif", help="render the logged run into a GIF")
+    args = parser.parse_args()
+
+    if args.run:
+        wx = [0.0, 10.0, 20.5, 35.0, 70.5]
+        wy = [0.0, -6.0, 5.0, 6.5, 0.0]
+        log_simulation(args.log, wx, wy, [[30.0, 8.0]])
+
+    meta, records = read_log(args.log)
+    status = STATUS[records["status"][-1]] if len(records) else "empty"
+    latency = records["latency"]
+    print("%d cycles, last status %s, latency median %.2f ms max %.2f ms, "
+          "%d bytes per cycle" % (
+              len(records), status, np.median(latency) * 1e3,
+              np.max(latency, initial=0.0) * 1e3, records.dtype.itemsize))
+
+    if args.gif:
+        import frenet_renderer
+        frenet_renderer.render_cycles(meta, render_records(records),
+                                      args.gif)
+
+
+if __name__ == '__main__':
+    main()